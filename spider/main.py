@@ -119,9 +119,10 @@ class SpiderEnhanced:
                     update_graph_from_spider_data(self.knowledge_graph, snapshot_data)
                     stats = self.knowledge_graph.get_database_stats()
                     print(f"[✓] knowledge: {stats['total_files']} files, {stats['total_relationships']} relationships")
-                    self.knowledge_graph.close_connection()
                 except Exception as e:
                     print(f"[!] knowledge update failed: {e}")
+                finally:
+                    self.knowledge_graph.close_connection()
             
             # save snapshot
             snapshot_path = self._save_snapshot(snapshot_data, "enhanced")
@@ -99,6 +99,11 @@ class KnowledgeServer:
                                 "type": "array",
                                 "items": {"type": "string"},
                                 "description": "Filter by relationship types (optional)"
+                            },
+                            "max_depth": {
+                                "type": "integer",
+                                "description": "Maximum number of hops to follow",
+                                "default": 1
                             }
                         },
                         "required": ["file_path"]
@@ -239,7 +244,7 @@ class KnowledgeServer:
                 elif name == "get_file_connections":
                     file_path = arguments["file_path"]
                     max_depth = arguments.get("max_depth", 2)
-                    connections = self.knowledge_graph.get_file_connections(file_path, max_depth)
+                    connections = self.knowledge_graph.get_file_connections(file_path, max_depth, include_metadata=True)
                     return [TextContent(
                         type="text",
                         text=json.dumps(connections, indent=2, default=str)
@@ -248,7 +253,8 @@ class KnowledgeServer:
                 elif name == "find_connected_files":
                     file_path = arguments["file_path"]
                     relationship_types = arguments.get("relationship_types")
-                    files = self.knowledge_graph.find_connected_files(file_path, relationship_types)
+                    max_depth = arguments.get("max_depth", 1)
+                    files = self.knowledge_graph.find_connected_files(file_path, relationship_types, max_depth)
                     return [TextContent(
                         type="text",
                         text=json.dumps(files, indent=2)
@@ -294,9 +300,10 @@ class KnowledgeServer:
                     strength = arguments.get("strength", 1.0)
                     metadata = arguments.get("metadata")
                     
-                    self.knowledge_graph.add_file_relationship(
-                        source_path, target_path, rel_type, strength, metadata
-                    )
+                    with self.knowledge_graph.transaction():
+                        self.knowledge_graph.add_file_relationship(
+                            source_path, target_path, rel_type, strength, metadata
+                        )
                     
                     return [TextContent(
                         type="text",
@@ -362,15 +369,9 @@ class KnowledgeServer:
             return {"error": "Knowledge graph not initialized"}
         
         try:
-            cursor = self.knowledge_graph.conn.execute("""
-                SELECT data_json
-                FROM system_snapshots
-                WHERE snapshot_id = ?
-            """, (snapshot_id,))
-            
-            row = cursor.fetchone()
-            if row:
-                return json.loads(row[0])
+            data = self.knowledge_graph.get_snapshot(snapshot_id)
+            if data is not None:
+                return data
             else:
                 return {"error": "Snapshot not found"}
         
@@ -21,7 +21,7 @@ from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
 
 # Import existing Spider components
-from spider.scanners.monitor import start_file_monitoring, get_file_changes
+from spider.scanners.inotify_monitor import start_file_monitoring, get_file_changes
 from spider.scanners.disk import scan_disks
 from spider.scanners.network import scan_network_interfaces
 from spider.scanners.docker import scan_docker_containers
@@ -0,0 +1,33 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# spider/scanners/_fastparse.pyx
+# compiled ndjson parser, same contract as remote._parse_ndjson_py
+
+from libc.string cimport memchr
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+def parse_ndjson(bytes raw):
+    """parse one json document per line, lines that don't parse are skipped"""
+    cdef const char *buf = PyBytes_AS_STRING(raw)
+    cdef Py_ssize_t n = len(raw)
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t end
+    cdef const char *nl
+    cdef list parsed = []
+
+    while i < n:
+        nl = <const char *>memchr(buf + i, b'\n', n - i)
+        end = nl - buf if nl != NULL else n
+        # only lines opening a json document reach the decoder
+        if end > i and (buf[i] == b'{' or buf[i] == b'['):
+            try:
+                parsed.append(_loads(PyBytes_FromStringAndSize(buf + i, end - i)))
+            except (ValueError, TypeError):
+                pass
+        i = end + 1
+
+    return parsed
@@ -0,0 +1,41 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# spider/scanners/_inotify_parse.pyx
+# compiled inotify event parser, same contract as inotify_monitor._parse_events_py
+
+from libc.string cimport memcpy
+
+cdef extern from "string.h":
+    size_t strnlen(const char *s, size_t maxlen)
+
+_UNKNOWN_WATCH = ('unknown', 'unknown/')
+
+def parse_events(const unsigned char[:] buf, Py_ssize_t n, dict watches):
+    """split a raw inotify read into (mask, directory, full_path, name) tuples"""
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t name_end
+    cdef int wd
+    cdef unsigned int mask
+    cdef unsigned int name_len
+    cdef const char *name_ptr
+    cdef list parsed = []
+
+    # header is int wd, uint32 mask, uint32 cookie, uint32 len
+    while i + 16 <= n:
+        memcpy(&wd, &buf[i], 4)
+        memcpy(&mask, &buf[i + 4], 4)
+        memcpy(&name_len, &buf[i + 12], 4)
+        i += 16
+
+        if name_len > 0:
+            name_ptr = <const char *>&buf[i]
+            name_end = strnlen(name_ptr, name_len)
+            name = name_ptr[:name_end].decode('utf-8', 'ignore')
+            i += name_len
+        else:
+            name = ''
+
+        directory, dir_prefix = watches.get(wd, _UNKNOWN_WATCH)
+        full_path = dir_prefix + name if name else directory
+        parsed.append((mask, directory, full_path, name))
+
+    return parsed
@@ -5,6 +5,7 @@
 import sys
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # add parent directory to path for imports
@@ -26,9 +27,14 @@ def scan_disks():
     if os.geteuid() != 0:
         result['warnings'].append('running without root - some disk info may be limited')
     
+    # lsblk and df are independent, run them side by side
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        lsblk_future = pool.submit(executor.run_command, 'lsblk -J -o NAME,TYPE,SIZE,MOUNTPOINT,FSTYPE,MODEL')
+        df_future = pool.submit(executor.run_command, 'df -h --output=source,size,used,avail,pcent,target')
+    
     # get block devices with details
     try:
-        lsblk_result = executor.run_command('lsblk -J -o NAME,TYPE,SIZE,MOUNTPOINT,FSTYPE,MODEL')
+        lsblk_result = lsblk_future.result()
         if lsblk_result['returncode'] == 0:
             try:
                 devices = json.loads(lsblk_result['stdout']).get('blockdevices', [])
@@ -74,7 +80,7 @@ def scan_disks():
     
     # get mount point usage
     try:
-        df_result = executor.run_command('df -h --output=source,size,used,avail,pcent,target')
+        df_result = df_future.result()
         if df_result['returncode'] == 0:
             lines = df_result['stdout'].strip().split('\n')[1:]  # skip header
             for line in lines:
@@ -11,13 +11,80 @@ import sys
 import os
 import re
 import json
+import itertools
+import mmap
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Any, Set
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from spider.scanners.osquery import get_scanner
+
+# file reads are io bound, overlap them across a small pool
+SCAN_WORKERS = 16
+
+# bigger files are minified data or dumps, not config worth scanning
+MAX_SCAN_SIZE = 512 * 1024
+# a nul byte in the first block marks a binary file
+SNIFF_BYTES = 512
+
+# important file types only
+SCAN_EXTENSIONS = {'.conf', '.cfg', '.yml', '.yaml', '.json', '.py', '.sh', '.service'}
+
+# quoted absolute paths start with one of these, and a path token runs to the
+# first quote, semicolon or whitespace
+_PATH_OPENERS = (b'"/', b"'/")
+_PATH_TOKEN = re.compile(rb'[^"\';\s]+')
+_QUOTES = (b'"', b"'")
+
+def _scan_path_refs(content):
+    # yield quoted absolute paths ending in a short lowercase extension, like
+    # '/etc/nginx/nginx.conf'; finds openers with bytes.find and never backtracks
+    for opener in _PATH_OPENERS:
+        i = content.find(opener)
+        while i >= 0:
+            token = _PATH_TOKEN.match(content, i + 1).group()
+            end = i + 1 + len(token)
+            if content[end:end + 1] in _QUOTES:
+                head, dot, ext = token.rpartition(b'.')
+                if dot and len(head) > 1 and 2 <= len(ext) <= 4 and ext.isalpha() and ext.islower():
+                    yield token
+                    # the closing quote is consumed, it can't open the next path
+                    end += 1
+            i = content.find(opener, end)
+
+def _walk_files(directory):
+    # one recursive scandir walk yielding DirEntry objects for wanted file types
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(entry.path)
+            elif os.path.splitext(entry.name)[1] in SCAN_EXTENSIONS and entry.is_file():
+                yield entry
+        except OSError:
+            continue
+
+class _FileRow:
+    # DirEntry look-alike for a row of osquery's file table, stat() is the row itself
+    __slots__ = ('path', 'name', 'st_size', 'st_mtime')
+    
+    def __init__(self, row):
+        self.path = row['path']
+        self.name = os.path.basename(self.path)
+        self.st_size = int(row['size'])
+        self.st_mtime = float(row['mtime'])
+    
+    def stat(self):
+        return self
+
 class FileRelationshipMapper:
     # builds file dependency maps using pattern matching and content analysis
     
@@ -30,11 +97,6 @@ class FileRelationshipMapper:
                 r'@import\s+["\']?([^"\';\s]+)["\']?',
                 r'require\s+["\']?([^"\';\s]+)["\']?'
             ],
-            'path_reference': [
-                r'["\']([/][^"\';\s]+\.[a-z]{2,4})["\']',
-                r'["\']([/][^"\';\s]+\.conf)["\']',
-                r'["\']([/][^"\';\s]+\.log)["\']'
-            ],
             'python_import': [
                 r'^from\s+([a-zA-Z_][a-zA-Z0-9_\.]*)\s+import',
                 r'^import\s+([a-zA-Z_][a-zA-Z0-9_\.]*)'
@@ -45,24 +107,44 @@ class FileRelationshipMapper:
                 r'volume:\s*["\']?([^"\':\s]+)["\']?'
             ]
         }
+        
+        # quoted 'path_reference' matches come from _scan_path_refs instead of a regex
+        
+        # fuse every pattern into one alternation so each file is scanned once,
+        # each pattern's capture becomes a named group that maps back to its type
+        alternatives = []
+        self.group_types = {}
+        for pattern_type, patterns in self.patterns.items():
+            for i, pattern in enumerate(patterns):
+                group = f'{pattern_type}_{i}'
+                self.group_types[group] = pattern_type
+                named = re.sub(r'(?<!\\)\((?!\?)', f'(?P<{group}>', pattern, count=1)
+                alternatives.append(named)
+        # bytes pattern so it can run straight over a mmap without decoding
+        self.combined = re.compile('|'.join(alternatives).encode(), re.MULTILINE)
     
     def scan_file_content(self, filepath):
         # extract references from file content using pattern matching
         refs = defaultdict(set)
+        # separator-terminated parent, relative references are a plain concat
+        parent = os.path.join(os.path.dirname(filepath), '')
         
         try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+            with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as content:
+                if b'\0' in content[:SNIFF_BYTES]:
+                    return refs
+                for match in self.combined.finditer(content):
+                    group = match.lastgroup
+                    # only the captured reference is decoded
+                    ref_path = match.group(group).decode('utf-8', errors='ignore')
+                    # resolve relative paths
+                    if not ref_path.startswith('/'):
+                        ref_path = parent + ref_path
+                    # the same targets recur across many files, share one string
+                    refs[self.group_types[group]].add(sys.intern(ref_path))
                 
-            for pattern_type, patterns in self.patterns.items():
-                for pattern in patterns:
-                    matches = re.finditer(pattern, content, re.MULTILINE)
-                    for match in matches:
-                        ref_path = match.group(1)
-                        # resolve relative paths
-                        if not ref_path.startswith('/'):
-                            ref_path = os.path.join(os.path.dirname(filepath), ref_path)
-                        refs[pattern_type].add(ref_path)
+                for ref_path in _scan_path_refs(content):
+                    refs['path_reference'].add(sys.intern(ref_path.decode('utf-8', errors='ignore')))
                         
         except Exception:
             # skip files that can't be read
@@ -70,6 +152,29 @@ class FileRelationshipMapper:
             
         return refs
     
+    def _scan_one(self, entry):
+        # read one file, returns (file_str, refs, stat) or None to skip it
+        try:
+            # stat comes from the scandir walk, so this check is free
+            st = entry.stat()
+            if st.st_size > MAX_SCAN_SIZE:
+                return None
+            file_str = sys.intern(entry.path)
+            file_refs = self.scan_file_content(file_str)
+            return file_str, file_refs, st
+        except (PermissionError, OSError):
+            # skip inaccessible files
+            return None
+    
+    def enumerate_via_osquery(self, directory, max_files=1000):
+        # candidate files from a running osqueryd, None to fall back to walking
+        scanner = get_scanner()
+        if not scanner.daemon_available():
+            return None
+        rows = scanner.list_files(directory, SCAN_EXTENSIONS, max_files)
+        # an empty result can't be told apart from a failed query, so walk instead
+        return [_FileRow(row) for row in rows] or None
+    
     def scan_directory(self, directory, max_files=1000):
         # scan directory for file relationships with limits
         results = {
@@ -80,47 +185,50 @@ class FileRelationshipMapper:
             'orphaned_files': []
         }
         
-        scanned_files = []
-        path_obj = Path(directory)
+        # let osqueryd list the tree when it runs here, otherwise walk it once
+        scanned_files = self.enumerate_via_osquery(directory, max_files)
+        if scanned_files is None:
+            scanned_files = list(itertools.islice(_walk_files(directory), max_files))
         
-        # collect important file types only
-        for ext in ['.conf', '.cfg', '.yml', '.yaml', '.json', '.py', '.sh', '.service']:
-            try:
-                pattern = f"**/*{ext}"
-                files = list(path_obj.glob(pattern))
-                scanned_files.extend(files[:max_files//8])
-            except PermissionError:
-                continue
+        # scan files for references in parallel, merge in order on this thread
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+            scanned = list(pool.map(self._scan_one, scanned_files))
         
-        # scan each file for references
-        for filepath in scanned_files[:max_files]:
-            if not filepath.is_file():
-                continue
-                
-            try:
-                file_str = str(filepath)
-                file_refs = self.scan_file_content(file_str)
-                
-                if file_refs:
-                    results['connections'][file_str] = {
-                        'size': filepath.stat().st_size,
-                        'modified': filepath.stat().st_mtime,
-                        'references': {k: list(v) for k, v in file_refs.items()}
-                    }
-                
-                # count file types
-                suffix = filepath.suffix or 'no_extension'
-                results['file_types'][suffix] += 1
-                results['files_scanned'] += 1
-                
-            except (PermissionError, OSError):
-                # skip inaccessible files
+        for entry, scanned_file in zip(scanned_files, scanned):
+            if scanned_file is None:
                 continue
+            file_str, file_refs, st = scanned_file
+            
+            if file_refs:
+                results['connections'][file_str] = {
+                    'size': st.st_size,
+                    'modified': st.st_mtime,
+                    'references': {k: list(v) for k, v in file_refs.items()}
+                }
+            
+            # count file types
+            suffix = os.path.splitext(entry.name)[1] or 'no_extension'
+            results['file_types'][suffix] += 1
+            results['files_scanned'] += 1
         
         return results
     
-    def build_dependency_graph(self, scan_results):
-        # create graph structure from scan results
+    def iter_edges(self, scan_results):
+        # yield one edge per reference, lazily so stats-only callers never hold the list
+        edge_id = 0
+        for source_file, data in scan_results.get('connections', {}).items():
+            for ref_type, ref_files in data.get('references', {}).items():
+                for target_file in ref_files:
+                    yield {
+                        'id': edge_id,
+                        'source': source_file,
+                        'target': target_file,
+                        'type': ref_type
+                    }
+                    edge_id += 1
+    
+    def build_dependency_graph(self, scan_results, include_edges=True):
+        # create graph structure from scan results, edges are left out unless include_edges
         graph = {
             'nodes': [],
             'edges': [],
@@ -136,54 +244,27 @@ class FileRelationshipMapper:
                 'type': Path(filepath).suffix
             })
         
-        # create edges for relationships
-        edge_id = 0
-        for source_file, data in scan_results.get('connections', {}).items():
-            for ref_type, ref_files in data.get('references', {}).items():
-                for target_file in ref_files:
-                    graph['edges'].append({
-                        'id': edge_id,
-                        'source': source_file,
-                        'target': target_file,
-                        'type': ref_type
-                    })
-                    edge_id += 1
+        # fold statistics over the edge stream
+        per_file = Counter()
+        per_type = Counter()
+        for edge in self.iter_edges(scan_results):
+            per_file[edge['source']] += 1
+            per_type[edge['type']] += 1
+            if include_edges:
+                graph['edges'].append(edge)
         
-        # calculate statistics
+        # most_common keeps ties in scan order
         graph['stats'] = {
             'total_files': len(graph['nodes']),
-            'total_connections': len(graph['edges']),
-            'most_connected': self._find_most_connected(scan_results),
-            'connection_types': self._count_connection_types(scan_results)
+            'total_connections': sum(per_type.values()),
+            'most_connected': [
+                {'file': filepath, 'connections': count}
+                for filepath, count in per_file.most_common(10)
+            ],
+            'connection_types': dict(per_type)
         }
         
         return graph
-    
-    def _find_most_connected(self, scan_results):
-        # find files with most relationships
-        connection_counts = defaultdict(int)
-        
-        for filepath, data in scan_results.get('connections', {}).items():
-            total_refs = sum(len(refs) for refs in data.get('references', {}).values())
-            connection_counts[filepath] = total_refs
-        
-        # sort by connection count
-        sorted_files = sorted(connection_counts.items(), key=lambda x: x[1], reverse=True)
-        
-        return [
-            {'file': filepath, 'connections': count}
-            for filepath, count in sorted_files[:10]
-        ]
-    
-    def _count_connection_types(self, scan_results):
-        # count different relationship types
-        type_counts = defaultdict(int)
-        
-        for data in scan_results.get('connections', {}).values():
-            for ref_type, refs in data.get('references', {}).items():
-                type_counts[ref_type] += len(refs)
-        
-        return dict(type_counts)
 
 def scan_file_relationships(directories=None):
     # main scanner function compatible with existing spider architecture
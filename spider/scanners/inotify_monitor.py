@@ -4,12 +4,18 @@
 
 import sys
 import os
+import bisect
+import fnmatch
+import itertools
+import operator
+import re
 import select
 import struct
+import time
 import ctypes
 import ctypes.util
 from datetime import datetime
-from collections import defaultdict, deque
+from collections import Counter, defaultdict, deque
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -20,6 +26,16 @@ IN_DELETE = 0x00000200
 IN_MOVED_TO = 0x00000080
 IN_MOVED_FROM = 0x00000040
 
+IN_Q_OVERFLOW = 0x00004000
+IN_EXCL_UNLINK = 0x04000000
+IN_CLOEXEC = 0o2000000
+
+MAX_READ_BUF_SIZE = 1 << 20
+
+# IN_ACCESS (0x1) and IN_OPEN (0x20) are left out on purpose: every read or open
+# in a watched dir like /etc would fire, so callers must pass them explicitly
+DEFAULT_MASK = IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM
+
 EVENT_NAMES = {
     IN_MODIFY: 'modified',
     IN_CREATE: 'created',
@@ -28,29 +44,104 @@ EVENT_NAMES = {
     IN_MOVED_FROM: 'moved_from'
 }
 
+# (mask, name) pairs for iteration, built once at import
+_EVT_TABLE = tuple(EVENT_NAMES.items())
+
+_UNKNOWN_WATCH = ('unknown', 'unknown' + os.sep)
+
+# event header (wd, mask, cookie, len) compiled once
+_EVT_HDR = struct.Struct('iIII')
+_KNOWN_MASK = IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM
+
+# every combination of known bits -> event names, so decode is one dict lookup
+_MASK_DECODE = {0: ()}
+for _bit, _name in _EVT_TABLE:
+    for _mask, _names in list(_MASK_DECODE.items()):
+        _MASK_DECODE[_mask | _bit] = _names + (_name,)
+
+def _parse_events_py(buf, n, watches):
+    # split a raw inotify read into (mask, directory, full_path, name) tuples
+    data = memoryview(buf)[:n]
+    parsed = []
+    i = 0
+    
+    while i < n:
+        wd, mask, cookie, name_len = _EVT_HDR.unpack_from(data, i)
+        i += _EVT_HDR.size
+        
+        name = ""
+        if name_len > 0:
+            name = bytes(data[i:i+name_len]).rstrip(b'\0').decode('utf-8', errors='ignore')
+            i += name_len
+        
+        directory, dir_prefix = watches.get(wd, _UNKNOWN_WATCH)
+        full_path = dir_prefix + name if name else directory
+        parsed.append((mask, directory, full_path, name))
+    
+    return parsed
+
+# compiled parser for high event rates, built with: cythonize -i spider/scanners/_inotify_parse.pyx
+try:
+    from ._inotify_parse import parse_events
+except ImportError:
+    parse_events = _parse_events_py
+
+def _load_libc():
+    # load libc and bind the inotify prototypes once, None if unavailable
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+        
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+_LIBC = _load_libc()
+
+def compile_path_patterns(patterns):
+    # compile glob patterns into one regex, or None to accept every path
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns))
+
 class INotifyTracker:
-    def __init__(self, max_events=1000):
+    def __init__(self, max_events=1000, read_buf_size=None, patterns=None, coalesce=False):
         self.fd = None
         self.watches = {}
+        self.path_filter = compile_path_patterns(patterns)
+        # merge repeated events on one path, once per read: all events from a read
+        # share its timestamp, so there is no finer window to merge within
+        self.coalesce = coalesce
         self.events = deque(maxlen=max_events)
         self.stats = defaultdict(int)
         self.libc = None
         
+        # one persistent read buffer, reused across reads (default 64 KiB)
+        if read_buf_size is None:
+            read_buf_size = int(os.environ.get('SPIDER_INOTIFY_BUF', 65536))
+        self.read_buf_size = read_buf_size
+        self.read_buf = bytearray(self.read_buf_size)
+        
     def initialize_inotify(self):
-        try:
-            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
-            
-            self.libc.inotify_init.argtypes = []
-            self.libc.inotify_init.restype = ctypes.c_int
-            
-            self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
-            self.libc.inotify_add_watch.restype = ctypes.c_int
-            
-            self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
-            self.libc.inotify_rm_watch.restype = ctypes.c_int
+        if _LIBC is None:
+            print("inotify init failed: libc inotify functions unavailable")
+            return False
             
-            self.fd = self.libc.inotify_init()
-            return self.fd >= 0
+        try:
+            self.libc = _LIBC
+            fd = self.libc.inotify_init1(IN_CLOEXEC)
+            if fd < 0:
+                return False
+            self.fd = fd
+            return True
             
         except Exception as e:
             print(f"inotify init failed: {e}")
@@ -61,13 +152,16 @@ class INotifyTracker:
             return None
             
         if mask is None:
-            mask = IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM
+            mask = DEFAULT_MASK
+        # never deliver events for children already unlinked from the dir
+        mask |= IN_EXCL_UNLINK
             
         try:
             wd = self.libc.inotify_add_watch(self.fd, path.encode(), mask)
             
             if wd >= 0:
-                self.watches[wd] = path
+                # keep a separator-terminated copy so event paths are a plain concat
+                self.watches[wd] = (path, path.rstrip(os.sep) + os.sep)
                 return wd
             else:
                 errno = ctypes.get_errno()
@@ -86,29 +180,33 @@ class INotifyTracker:
             return []
             
         try:
-            data = os.read(self.fd, 4096)
+            n = os.readv(self.fd, [self.read_buf])
             events = []
-            i = 0
+            counts = Counter()
+            pending = {}  # path -> event from this read, used when coalescing
+            batch_ts = time.time()  # one read is one instant, stamp every event with it
             
-            while i < len(data):
-                wd, mask, cookie, name_len = struct.unpack('iIII', data[i:i+16])
-                i += 16
+            for mask, directory, full_path, name in parse_events(self.read_buf, n, self.watches):
+                if mask & IN_Q_OVERFLOW:
+                    self._handle_overflow()
+                    continue
                 
-                name = ""
-                if name_len > 0:
-                    name = data[i:i+name_len].rstrip(b'\0').decode('utf-8', errors='ignore')
-                    i += name_len
+                # drop unwatched files before building the event
+                if self.path_filter is not None and not self.path_filter.match(full_path):
+                    continue
                 
-                directory = self.watches.get(wd, 'unknown')
-                full_path = os.path.join(directory, name) if name else directory
+                event_types = _MASK_DECODE[mask & _KNOWN_MASK]
+                counts.update(event_types)
                 
-                event_types = []
-                for event_mask, event_name in EVENT_NAMES.items():
-                    if mask & event_mask:
-                        event_types.append(event_name)
+                # fold repeated events on the same path (editor saves, log rotation)
+                if self.coalesce:
+                    prev = pending.get(full_path)
+                    if prev is not None:
+                        prev['event_types'] += tuple(t for t in event_types if t not in prev['event_types'])
+                        continue
                 
                 event = {
-                    'timestamp': datetime.now().isoformat(),
+                    'ts': batch_ts,
                     'path': full_path,
                     'directory': directory,
                     'filename': name,
@@ -116,28 +214,33 @@ class INotifyTracker:
                 }
                 
                 events.append(event)
-                self.events.append(event)
-                
-                for event_type in event_types:
-                    self.stats[event_type] += 1
-                    
+                pending[full_path] = event
+
+            # commit the whole batch at once
+            self.events.extend(events)
+            for event_type, count in counts.items():
+                self.stats[event_type] += count
+
             return events
         except Exception:
             return []
     
+    def _handle_overflow(self):
+        # the kernel queue overflowed and events were dropped, grow the read buffer
+        self.stats['overflow'] += 1
+        new_size = min(self.read_buf_size * 2, MAX_READ_BUF_SIZE)
+        print(f"inotify queue overflow, events were lost (read buffer {self.read_buf_size} -> {new_size} bytes); "
+              "if this persists raise /proc/sys/fs/inotify/max_queued_events")
+        if new_size != self.read_buf_size:
+            self.read_buf_size = new_size
+            self.read_buf = bytearray(new_size)
+    
     def get_recent_events(self, minutes=5):
-        cutoff = datetime.now().timestamp() - (minutes * 60)
-        recent = []
+        cutoff = time.time() - (minutes * 60)
         
-        for event in self.events:
-            try:
-                event_time = datetime.fromisoformat(event['timestamp']).timestamp()
-                if event_time >= cutoff:
-                    recent.append(event)
-            except:
-                continue
-                
-        return recent
+        # events are appended in time order, so bisect straight to the cutoff
+        idx = bisect.bisect_left(self.events, cutoff, key=operator.itemgetter('ts'))
+        return list(itertools.islice(self.events, idx, None))
     
     def cleanup(self):
         if self.fd is not None:
@@ -146,9 +249,10 @@ class INotifyTracker:
             self.watches.clear()
 
 class FileChangeMonitor:
-    def __init__(self, watch_dirs=None):
-        self.tracker = INotifyTracker()
+    def __init__(self, watch_dirs=None, patterns=None, mask=None, coalesce=False):
+        self.tracker = INotifyTracker(patterns=patterns, coalesce=coalesce)
         self.watch_dirs = watch_dirs or ['/etc', '/home/abidan/spider', '/var/log']
+        self.mask = mask
         self.running = False
         
     def start_monitoring(self):
@@ -158,7 +262,7 @@ class FileChangeMonitor:
         watch_count = 0
         for directory in self.watch_dirs:
             if os.path.exists(directory):
-                wd = self.tracker.add_directory_watch(directory)
+                wd = self.tracker.add_directory_watch(directory, self.mask)
                 if wd is not None:
                     watch_count += 1
         
@@ -193,7 +297,7 @@ class FileChangeMonitor:
             
             if len(summary['recent_changes']) < 10:
                 summary['recent_changes'].append({
-                    'time': event['timestamp'],
+                    'time': datetime.fromtimestamp(event['ts']).isoformat(),
                     'file': event['path'],
                     'changes': event['event_types']
                 })
@@ -208,11 +312,11 @@ class FileChangeMonitor:
         self.running = False
         self.tracker.cleanup()
 
-def start_file_monitoring(directories=None):
+def start_file_monitoring(directories=None, patterns=None, mask=None):
     if directories is None:
         directories = ['/etc', '/home/abidan/spider', '/var/log']
     
-    monitor = FileChangeMonitor(directories)
+    monitor = FileChangeMonitor(directories, patterns, mask)
     
     if monitor.start_monitoring():
         return monitor
@@ -8,45 +8,208 @@ scans network interfaces, routing, and connections
 
 import sys
 import os
-import subprocess
+import copy
+import socket
+import time
 from datetime import datetime
 
-def scan_network_interfaces():
-    """scan network interfaces"""
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# interfaces and listeners change on the order of minutes, polling loops reuse a recent scan;
+# every caller gets its own copy, so changing a result can't leak into the next one
+NETWORK_CACHE_TTL = 5.0
+_scan_cache = {'ts': 0.0, 'val': None}
+
+# /proc/net socket states we report as listening
+TCP_LISTEN = '0A'
+UDP_UNCONN = '07'
+
+# tcp states as printed in /proc/net/tcp, named the way psutil names them
+TCP_STATES = {
+    '01': 'ESTABLISHED', '02': 'SYN_SENT', '03': 'SYN_RECV', '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2', '06': 'TIME_WAIT', '07': 'CLOSE', '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK', '0A': 'LISTEN', '0B': 'CLOSING',
+}
+
+FAMILY_NAMES = {
+    socket.AF_INET: 'ipv4',
+    socket.AF_INET6: 'ipv6',
+}
+if hasattr(socket, 'AF_PACKET'):
+    FAMILY_NAMES[socket.AF_PACKET] = 'mac'
+
+# both interface sources emit the same keys, None where a source can't tell
+def _interfaces_from_psutil():
+    """interfaces with addresses, link state and byte counters from psutil"""
+    stats = psutil.net_if_stats()
+    io = psutil.net_io_counters(pernic=True)
+    interfaces = []
+    for name, addrs in psutil.net_if_addrs().items():
+        st = stats.get(name)
+        counters = io.get(name)
+        interfaces.append({
+            'name': name,
+            'is_up': st.isup if st else None,
+            'mtu': st.mtu if st else None,
+            'speed_mbps': st.speed if st else None,
+            'rx_bytes': counters.bytes_recv if counters else None,
+            'tx_bytes': counters.bytes_sent if counters else None,
+            'addresses': [
+                {
+                    'family': FAMILY_NAMES.get(addr.family, str(addr.family)),
+                    'address': addr.address,
+                    'netmask': addr.netmask
+                }
+                for addr in addrs
+            ]
+        })
+    return interfaces
+
+def _interfaces_from_proc():
+    """interface names and byte counters from /proc/net/dev, link state and addresses unknown"""
+    interfaces = []
+    with open('/proc/net/dev') as f:
+        lines = f.read().splitlines()[2:]  # skip the two header lines
+    for line in lines:
+        name, _, counters = line.partition(':')
+        fields = counters.split()
+        interfaces.append({
+            'name': name.strip(),
+            'is_up': None,
+            'mtu': None,
+            'speed_mbps': None,
+            'rx_bytes': int(fields[0]),
+            'tx_bytes': int(fields[8]),
+            'addresses': []
+        })
+    return interfaces
+
+def _decode_proc_addr(hex_addr):
+    """decode a /proc/net address like 0100007F:0035 into (ip, port)"""
+    host, port = hex_addr.split(':')
+    raw = bytes.fromhex(host)
+    if sys.byteorder == 'little':
+        # the kernel prints each 32-bit word in host byte order
+        raw = b''.join(raw[i:i+4][::-1] for i in range(0, len(raw), 4))
+    family = socket.AF_INET if len(raw) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, raw), int(port, 16)
+
+def _listening_from_psutil():
+    """listening tcp/udp sockets from psutil"""
+    ports = []
+    for conn in psutil.net_connections(kind='inet'):
+        if conn.type == socket.SOCK_STREAM:
+            if conn.status != psutil.CONN_LISTEN:
+                continue
+            proto = 'tcp'
+        elif conn.raddr:
+            continue
+        else:
+            proto = 'udp'
+        if conn.family == socket.AF_INET6:
+            proto += '6'
+        ports.append({'proto': proto, 'address': conn.laddr.ip, 'port': conn.laddr.port})
+    return ports
+
+def _listening_from_proc():
+    """listening tcp/udp sockets from /proc/net/{tcp,udp}[6]"""
+    ports = []
+    for proto, listen_state in (('tcp', TCP_LISTEN), ('tcp6', TCP_LISTEN),
+                                ('udp', UDP_UNCONN), ('udp6', UDP_UNCONN)):
+        try:
+            with open(f'/proc/net/{proto}') as f:
+                lines = f.read().splitlines()[1:]  # skip header
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4 or fields[3] != listen_state:
+                continue
+            address, port = _decode_proc_addr(fields[1])
+            ports.append({'proto': proto, 'address': address, 'port': port})
+    return ports
+
+def _connections_from_psutil():
+    """(proto, laddr, lport, state) for every inet socket from psutil"""
+    connections = []
+    for conn in psutil.net_connections(kind='inet'):
+        proto = 'tcp' if conn.type == socket.SOCK_STREAM else 'udp'
+        if conn.family == socket.AF_INET6:
+            proto += '6'
+        connections.append((proto, conn.laddr.ip, conn.laddr.port, conn.status))
+    return connections
+
+def _connections_from_proc():
+    """(proto, laddr, lport, state) for every inet socket from /proc/net"""
+    connections = []
+    for proto in ('tcp', 'tcp6', 'udp', 'udp6'):
+        try:
+            with open(f'/proc/net/{proto}') as f:
+                lines = f.read().splitlines()[1:]  # skip header
+        except OSError:
+            continue
+        is_tcp = proto.startswith('tcp')
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            address, port = _decode_proc_addr(fields[1])
+            state = TCP_STATES.get(fields[3], fields[3]) if is_tcp else 'NONE'
+            connections.append((proto, address, port, state))
+    return connections
+
+def _scan_connections():
+    """list inet sockets as (proto, laddr, lport, state) tuples"""
+    if PSUTIL_AVAILABLE:
+        try:
+            return _connections_from_psutil()
+        except Exception:
+            pass
+    return _connections_from_proc()
+
+def scan_network_interfaces(force=False):
+    """scan network interfaces, reusing a scan younger than NETWORK_CACHE_TTL unless force"""
+    now = time.monotonic()
+    if not force and _scan_cache['val'] is not None and now - _scan_cache['ts'] < NETWORK_CACHE_TTL:
+        result = copy.deepcopy(_scan_cache['val'])
+        result['scan_time'] = datetime.now().isoformat()
+        return result
+    
     result = {
         'scan_time': datetime.now().isoformat(),
         'interfaces': [],
         'connections': []
     }
-    
-    # get interfaces - try without sudo first
+
+    # read kernel state directly instead of forking ip/ss
     try:
-        ip_result = subprocess.run(['ip', 'addr', 'show'], capture_output=True, text=True, timeout=10)
-        if ip_result.returncode == 0:
-            result['ip_addr_output'] = ip_result.stdout
-        else:
-            # fallback to sudo if needed
-            ip_result = subprocess.run(['sudo', 'ip', 'addr', 'show'], capture_output=True, text=True, timeout=10)
-            if ip_result.returncode == 0:
-                result['ip_addr_output'] = ip_result.stdout
-    except:
-        result['ip_addr_output'] = 'failed to get network interfaces'
-    
-    # get connections - try without sudo first
+        result['interfaces'] = _interfaces_from_psutil() if PSUTIL_AVAILABLE else _interfaces_from_proc()
+    except Exception as e:
+        result['interfaces_error'] = f'failed to get network interfaces: {e}'
+
     try:
-        ss_result = subprocess.run(['ss', '-tuln'], capture_output=True, text=True, timeout=10)
-        if ss_result.returncode == 0:
-            result['listening_ports'] = ss_result.stdout
-        else:
-            # fallback to sudo if needed
-            ss_result = subprocess.run(['sudo', 'ss', '-tuln'], capture_output=True, text=True, timeout=10)
-            if ss_result.returncode == 0:
-                result['listening_ports'] = ss_result.stdout
-    except:
-        result['listening_ports'] = 'failed to get network connections'
-    
-    return result
+        result['listening_ports'] = _listening_from_psutil() if PSUTIL_AVAILABLE else _listening_from_proc()
+    except Exception:
+        # psutil can be denied socket info on hardened hosts, /proc still works
+        try:
+            result['listening_ports'] = _listening_from_proc()
+        except Exception as e:
+            result['listening_ports'] = []
+            result['listening_ports_error'] = f'failed to get network connections: {e}'
+
+    try:
+        result['connections'] = _scan_connections()
+    except Exception as e:
+        result['connections_error'] = f'failed to get network connections: {e}'
+
+    _scan_cache['ts'] = now
+    _scan_cache['val'] = result
+    return copy.deepcopy(result)
 
 def scan_network_connections():
     """get network connections"""
-    return scan_network_interfaces()['connections']
+    return _scan_connections()
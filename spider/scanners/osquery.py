@@ -7,44 +7,293 @@ deep system introspection using osquery
 """
 
 import json
+import os
 import subprocess
 import time
 import re
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Any, List
-# from prometheus_client import Gauge, Counter
+from typing import Dict, Any, List, Optional
+
+try:
+    from prometheus_client import Gauge, Counter
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import osquery
+    OSQUERY_CLIENT_AVAILABLE = True
+except ImportError:
+    OSQUERY_CLIENT_AVAILABLE = False
+
+# extension socket of a system osqueryd, used before spawning our own
+OSQUERY_SOCKET = '/var/osquery/osquery.em'
+
+# query results are reused for this long, roughly one scan interval
+QUERY_CACHE_TTL = 30.0
+QUERY_CACHE_SIZE = 256
+
+# marker row emitted after each statement in a batched osqueryi run
+QUERY_MARKER = '###SEP###'
+
+def _iter_json_arrays(raw: bytes):
+    """yield each top-level json array from concatenated osqueryi --json output"""
+    raw = raw.strip()
+    if not raw:
+        return
+    # json strings can't hold a raw newline, so ']\n[' only occurs between arrays;
+    # join them into one outer array and parse the bytes in a single call
+    yield from _json_loads(b'[' + raw.replace(b']\n[', b'],[') + b']')
+
+def _normalize_sql(sql: str) -> str:
+    """collapse whitespace so formatting differences share a cache entry"""
+    return ' '.join(sql.split())
+
+def _sql_quote(value: str) -> str:
+    """quote a value as an sqlite string literal, osquery has no bound parameters"""
+    return "'" + value.replace("\0", "").replace("'", "''") + "'"
+
+class _NullMetric:
+    # stands in for prometheus metrics when prometheus_client is missing
+    def inc(self, amount=1):
+        pass
+    
+    def set(self, value):
+        pass
 
 class OSQueryScanner:
+    # osqueryi --version result, shared by every scanner once checked
+    _installed = None
+    
     def __init__(self):
         self.osquery_path = "osqueryi"
         
-        # prometheus metrics
-        self.osquery_queries = Counter('spider_osquery_queries_total', 'osquery queries executed')
-        self.osquery_duration = Gauge('spider_osquery_duration_seconds', 'last osquery scan duration')
-        self.files_tracked = Gauge('spider_osquery_files_tracked', 'files tracked by osquery')
+        # thrift client to a long-lived osqueryd, None until first use
+        self._client = None
+        self._instance = None
+        self._client_failed = False
+        
+        # normalized sql -> (monotonic time, rows), oldest first
+        self._cache = OrderedDict()
+        
+        # prometheus metrics, registered once so use get_scanner() for a shared instance
+        if PROMETHEUS_AVAILABLE:
+            self.osquery_queries = Counter('spider_osquery_queries_total', 'osquery queries executed')
+            self.osquery_duration = Gauge('spider_osquery_duration_seconds', 'last osquery scan duration')
+            self.files_tracked = Gauge('spider_osquery_files_tracked', 'files tracked by osquery')
+        else:
+            self.osquery_queries = self.osquery_duration = self.files_tracked = _NullMetric()
         
     def check_osquery_installed(self) -> bool:
         """check if osquery is available"""
+        if OSQueryScanner._installed is not None:
+            return OSQueryScanner._installed
+        
         try:
             result = subprocess.run([self.osquery_path, "--version"], 
                                   capture_output=True, timeout=5)
-            return result.returncode == 0
+            installed = result.returncode == 0
         except:
-            return False
+            installed = False
+        
+        OSQueryScanner._installed = installed
+        return installed
+    
+    def _get_client(self):
+        """thrift client for osqueryd, connecting or spawning once; None means use osqueryi"""
+        if self._client is not None or self._client_failed or not OSQUERY_CLIENT_AVAILABLE:
+            return self._client
+        
+        try:
+            if os.path.exists(OSQUERY_SOCKET):
+                self._instance = osquery.ExtensionClient(OSQUERY_SOCKET)
+                self._instance.open()
+                self._client = self._instance.extension_client()
+            else:
+                # ephemeral osqueryd with no database or logging, owned by this scanner
+                self._instance = osquery.SpawnInstance()
+                self._instance.open()
+                self._client = self._instance.client
+        except Exception as e:
+            print(f"osqueryd socket unavailable, using osqueryi: {e}")
+            self._instance = None
+            self._client = None
+            self._client_failed = True
+        
+        return self._client
+    
+    def daemon_available(self) -> bool:
+        """true when a system osqueryd answers on its extension socket"""
+        return os.path.exists(OSQUERY_SOCKET) and self._get_client() is not None
+    
+    def _client_query(self, client, sql: str) -> Optional[List[Dict]]:
+        """run sql over the osqueryd socket, rows come back already parsed; None on error"""
+        try:
+            result = client.query(sql)
+            if result.status.code != 0:
+                print(f"osquery error: {result.status.message}")
+                return None
+            return result.response
+        except Exception as e:
+            print(f"osquery error: {e}")
+            return None
+    
+    def close(self):
+        """drop the osqueryd connection, stopping it if we spawned it"""
+        if self._instance is not None:
+            try:
+                if hasattr(self._instance, 'close'):
+                    self._instance.close()
+            except Exception:
+                pass
+        self._instance = None
+        self._client = None
+    
+    def _cache_get(self, key: str):
+        """cached rows for a normalized query, None if missing or expired"""
+        hit = self._cache.get(key)
+        if hit is None:
+            return None
+        stored_at, rows = hit
+        if time.monotonic() - stored_at > QUERY_CACHE_TTL:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        # callers get their own rows, so mutating a result can't change the cache
+        return [dict(row) for row in rows]
+    
+    def _cache_put(self, key: str, rows: List[Dict]):
+        self._cache[key] = (time.monotonic(), [dict(row) for row in rows])
+        self._cache.move_to_end(key)
+        if len(self._cache) > QUERY_CACHE_SIZE:
+            self._cache.popitem(last=False)
     
     def query(self, sql: str) -> List[Dict]:
         """execute osquery sql and return results"""
+        key = _normalize_sql(sql)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        rows = self._run_query(sql)
+        # a failed query isn't cached, the next call tries again
+        if rows is None:
+            return []
+        self._cache_put(key, rows)
+        return rows
+    
+    def _run_query(self, sql: str) -> Optional[List[Dict]]:
+        """rows for one query, None when it failed"""
         self.osquery_queries.inc()
+        
+        client = self._get_client()
+        if client is not None:
+            return self._client_query(client, sql)
+        
         try:
             cmd = [self.osquery_path, "--json", sql]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            # keep stdout as bytes, both orjson and json parse utf-8 bytes directly;
+            # stderr is never read so don't buffer it
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30)
             
             if result.returncode == 0:
-                return json.loads(result.stdout)
-            return []
+                return _json_loads(result.stdout)
+            return None
         except Exception as e:
             print(f"osquery error: {e}")
-            return []
+            return None
+    
+    def query_many(self, sqls: Dict[str, str]) -> Dict[str, List[Dict]]:
+        """execute several named queries, serving repeats from the cache"""
+        results = {}
+        missing = {}
+        for name, sql in sqls.items():
+            cached = self._cache_get(_normalize_sql(sql))
+            if cached is None:
+                missing[name] = sql
+            else:
+                results[name] = cached
+        
+        # failed queries come back as None, they're reported empty and not cached
+        for name, rows in self._run_many(missing).items():
+            if rows is None:
+                results[name] = []
+            else:
+                self._cache_put(_normalize_sql(missing[name]), rows)
+                results[name] = rows
+        
+        # keep the caller's key order
+        return {name: results[name] for name in sqls}
+    
+    def _run_many(self, sqls: Dict[str, str]) -> Dict[str, Optional[List[Dict]]]:
+        """execute several named queries over the socket, or in a single osqueryi process, None where one failed"""
+        results = {name: None for name in sqls}
+        if not sqls:
+            return results
+        
+        self.osquery_queries.inc(len(sqls))
+        
+        # over the socket each query is a cheap ipc round-trip, no batching needed
+        client = self._get_client()
+        if client is not None:
+            return {name: self._client_query(client, sql) for name, sql in sqls.items()}
+        
+        # each statement is followed by a marker row naming it, so empty results and
+        # failed statements can't shift the output onto the wrong query
+        script = ''.join(
+            f"{sql.strip().rstrip(';')}\n;\n"
+            f"SELECT '{QUERY_MARKER}' AS marker, '{name}' AS query_name;\n"
+            for name, sql in sqls.items()
+        )
+        
+        try:
+            result = subprocess.run([self.osquery_path, "--json"], input=script.encode(),
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    timeout=30 * len(sqls))
+            
+            # a statement counts only if it emitted its own section before the marker,
+            # a rejected one prints nothing to stdout and stays None
+            rows, emitted = [], False
+            for block in _iter_json_arrays(result.stdout):
+                if len(block) == 1 and block[0].get('marker') == QUERY_MARKER:
+                    if emitted:
+                        results[block[0]['query_name']] = rows
+                    rows, emitted = [], False
+                else:
+                    rows.extend(block)
+                    emitted = True
+            
+            # errors on stderr can't be tied to a statement, so empty sections
+            # from that run are treated as failed rather than cached
+            if result.stderr.strip():
+                for name, rows in results.items():
+                    if not rows:
+                        results[name] = None
+        except Exception as e:
+            print(f"osquery error: {e}")
+        
+        return results
+    
+    def list_files(self, directory: str, extensions, limit: int = 1000) -> List[Dict]:
+        """regular files under directory (recursive) with one of the extensions"""
+        # '%%' is osquery's recursive wildcard, filename isn't a constraint column
+        # so the extension filter runs in sqlite over the listed rows
+        wanted = ' OR '.join(f"filename LIKE {_sql_quote('%' + ext)}" for ext in sorted(extensions))
+        return self.query(f"""
+        SELECT path, size, mtime
+        FROM file
+        WHERE path LIKE {_sql_quote(directory.rstrip('/') + '/%%')}
+        AND type = 'regular'
+        AND ({wanted})
+        LIMIT {int(limit)}
+        """)
     
     def scan_critical_file_relationships(self) -> Dict[str, Any]:
         """enhanced file relationships for homelab monitoring"""
@@ -57,87 +306,79 @@ class OSQueryScanner:
             'process_file_map': {},
             'recent_changes': []
         }
+        sqls = {}
         
-        # critical config files
-        config_files = self.query("""
-        SELECT path, size, mtime, ctime, uid, gid, permissions
-        FROM file 
-        WHERE (path LIKE '/etc/systemd/%'
-           OR path LIKE '/etc/nginx/%'
-           OR path LIKE '/etc/ssh/%'
-           OR path LIKE '/etc/docker/%'
-           OR path LIKE '/home/abidan/spider/%')
+        # critical config files, docker files and last-24h changes in one pass;
+        # directory is an indexed constraint so osquery lists each dir once
+        sqls['tracked_files'] = """
+        SELECT path, size, mtime, permissions, uid, gid, 'config' AS bucket
+        FROM file
+        WHERE directory IN ('/etc/systemd', '/etc/nginx', '/etc/ssh', '/etc/docker',
+                            '/home/abidan/spider')
         AND size < 1000000
-        ORDER BY mtime DESC
-        """)
-        relationships['config_files'] = config_files
-        
-        # docker-specific files
-        docker_configs = self.query("""
-        SELECT path, size, mtime, permissions
+        UNION ALL
+        SELECT path, size, mtime, permissions, uid, gid, 'docker' AS bucket
         FROM file
-        WHERE path LIKE '/var/lib/docker/%'
-           OR path LIKE '/etc/docker/%'
-           OR path = '/usr/bin/docker'
-           OR path = '/usr/bin/docker-compose'
-        """)
-        relationships['docker_configs'] = docker_configs
+        WHERE directory IN ('/var/lib/docker', '/etc/docker')
+           OR path IN ('/usr/bin/docker', '/usr/bin/docker-compose')
+        UNION ALL
+        SELECT path, size, mtime, permissions, uid, gid, 'recent' AS bucket
+        FROM file
+        WHERE directory IN ('/etc', '/home/abidan/spider', '/var/lib/docker')
+        AND mtime > strftime('%s', 'now', '-1 day')
+        ORDER BY mtime DESC
+        """
         
         # active systemd services and their files
-        systemd_services = self.query("""
+        sqls['systemd_services'] = """
         SELECT name, status, active_enter_timestamp, memory_current, 
                cpu_usage_nsec, fragment_path
         FROM systemd_units
         WHERE unit_type = 'service' 
         AND (active = 'active' OR active = 'failed')
-        """)
-        relationships['systemd_services'] = systemd_services
-        
-        # process to file mappings (critical for impact analysis)
-        process_files = self.query("""
-        SELECT p.name, p.pid, p.cmdline, f.path, f.fd
+        """
+        
+        # process to file mappings (critical for impact analysis), grouped by
+        # process inside osquery so name and cmdline come back once per process;
+        # files are newline separated since paths can contain commas
+        sqls['process_files'] = """
+        SELECT p.name, p.cmdline,
+               GROUP_CONCAT(DISTINCT p.pid) AS pids,
+               GROUP_CONCAT(f.path, CHAR(10)) AS files
         FROM processes p
         JOIN process_open_files f ON p.pid = f.pid
         WHERE f.path LIKE '/etc/%'
            OR f.path LIKE '/opt/%'
            OR f.path LIKE '/var/log/%'
            OR f.path LIKE '/var/lib/docker/%'
+        GROUP BY p.name
         ORDER BY p.name
         LIMIT 200
-        """)
-        
-        # group by process for easier analysis
-        process_map = {}
-        for pf in process_files:
-            proc_name = pf['name']
-            if proc_name not in process_map:
-                process_map[proc_name] = {
-                    'pids': set(),
-                    'files': set(),
-                    'cmdline': pf.get('cmdline', '')
-                }
-            process_map[proc_name]['pids'].add(pf['pid'])
-            process_map[proc_name]['files'].add(pf['path'])
-        
-        # convert sets to lists for json serialization
-        for proc in process_map:
-            process_map[proc]['pids'] = list(process_map[proc]['pids'])
-            process_map[proc]['files'] = list(process_map[proc]['files'])
-        
-        relationships['process_file_map'] = process_map
-        
-        # files modified in last 24 hours
-        recent_changes = self.query("""
-        SELECT path, mtime, size, uid, gid
-        FROM file
-        WHERE path LIKE '/etc/%'
-           OR path LIKE '/home/abidan/spider/%'
-           OR path LIKE '/var/lib/docker/%'
-        AND mtime > strftime('%s', 'now', '-1 day')
-        ORDER BY mtime DESC
-        LIMIT 50
-        """)
-        relationships['recent_changes'] = recent_changes
+        """
+        
+        results = self.query_many(sqls)
+        relationships['systemd_services'] = results['systemd_services']
+        
+        # split the combined file query back out by bucket (already newest first)
+        buckets = {'config': relationships['config_files'],
+                   'docker': relationships['docker_configs'],
+                   'recent': relationships['recent_changes']}
+        for row in results['tracked_files']:
+            bucket = buckets.get(row.pop('bucket', None))
+            if bucket is not None:
+                bucket.append(row)
+        del relationships['recent_changes'][50:]
+        
+        # one row per process, split the concatenated columns back out;
+        # the same file open on several fds or pids is listed once
+        relationships['process_file_map'] = {
+            pf['name']: {
+                'pids': pf['pids'].split(',') if pf.get('pids') else [],
+                'files': list(dict.fromkeys(pf['files'].split('\n'))) if pf.get('files') else [],
+                'cmdline': pf.get('cmdline', '')
+            }
+            for pf in results['process_files']
+        }
         
         return relationships
     
@@ -150,29 +391,28 @@ class OSQueryScanner:
             'disk_health': [],
             'process_health': []
         }
+        sqls = {}
         
         # docker container info via processes
-        docker_processes = self.query("""
+        sqls['docker_containers'] = """
         SELECT name, pid, cmdline, cpu_time, memory_size
         FROM processes
         WHERE name = 'docker' 
            OR name = 'containerd'
            OR cmdline LIKE '%docker%'
-        """)
-        services['docker_containers'] = docker_processes
+        """
         
         # critical systemd services
-        systemd_health = self.query("""
+        sqls['systemd_health'] = """
         SELECT name, status, active_enter_timestamp, memory_current,
                fragment_path, wants, requires
         FROM systemd_units
         WHERE name IN ('docker.service', 'ssh.service', 'nginx.service',
                       'systemd-resolved.service', 'NetworkManager.service')
-        """)
-        services['systemd_health'] = systemd_health
+        """
         
         # network services
-        network_services = self.query("""
+        sqls['network_services'] = """
         SELECT DISTINCT p.name, p.pid, s.local_address, s.local_port, 
                s.protocol, p.cpu_time, p.memory_size
         FROM processes p
@@ -180,30 +420,29 @@ class OSQueryScanner:
         WHERE s.state = 'LISTEN'
         AND (s.local_port IN ('22', '80', '443', '8080', '7860', '11434')
              OR p.name IN ('sshd', 'nginx', 'apache2', 'docker'))
-        """)
-        services['network_services'] = network_services
+        """
         
         # disk/filesystem health indicators
-        disk_health = self.query("""
+        sqls['disk_health'] = """
         SELECT device, path, type, flags, blocks_size, blocks_free, 
                blocks_available, inodes_free
         FROM mounts
         WHERE path IN ('/', '/home', '/var', '/opt', '/DATA')
            OR type = 'ext4'
            OR type = 'xfs'
-        """)
-        services['disk_health'] = disk_health
+        """
         
         # resource-heavy processes
-        process_health = self.query("""
+        sqls['process_health'] = """
         SELECT name, pid, cpu_time, memory_size, state, nice
         FROM processes
         WHERE memory_size > 100000000  -- >100MB
            OR cpu_time > 60  -- >1min cpu
         ORDER BY memory_size DESC
         LIMIT 30
-        """)
-        services['process_health'] = process_health
+        """
+        
+        services.update(self.query_many(sqls))
         
         return services
     
@@ -217,56 +456,54 @@ class OSQueryScanner:
             'docker_security': [],
             'file_permissions': []
         }
+        sqls = {}
         
         # ssh-related processes and connections
-        ssh_activity = self.query("""
+        sqls['ssh_activity'] = """
         SELECT p.name, p.pid, p.cmdline, s.local_port, s.remote_address
         FROM processes p
         LEFT JOIN process_open_sockets s ON p.pid = s.pid
         WHERE p.name IN ('sshd', 'ssh')
            OR p.cmdline LIKE '%ssh%'
-        """)
-        security['ssh_activity'] = ssh_activity
+        """
         
         # all listening services (potential attack surface)
-        listening = self.query("""
+        sqls['listening_services'] = """
         SELECT DISTINCT p.name, s.local_address, s.local_port, s.protocol,
                p.uid, p.gid, p.cmdline
         FROM processes p
         JOIN process_open_sockets s ON p.pid = s.pid
         WHERE s.state = 'LISTEN'
         ORDER BY CAST(s.local_port AS INTEGER)
-        """)
-        security['listening_services'] = listening
+        """
         
         # suid/sgid files (security risk)
-        suid_files = self.query("""
+        sqls['suid_files'] = """
         SELECT path, permissions, uid, gid, size
         FROM file
         WHERE (path LIKE '/usr/bin/%' OR path LIKE '/usr/sbin/%' OR path LIKE '/bin/%')
         AND (permissions LIKE '%s%' OR permissions LIKE '%S%')
         ORDER BY path
-        """)
-        security['suid_files'] = suid_files
+        """
         
         # docker-related security
-        docker_security = self.query("""
+        sqls['docker_security'] = """
         SELECT path, permissions, uid, gid
         FROM file
         WHERE path = '/var/run/docker.sock'
            OR path LIKE '/var/lib/docker/containers/%/config.json'
-        """)
-        security['docker_security'] = docker_security
+        """
         
         # world-writable files in critical locations
-        file_permissions = self.query("""
+        sqls['file_permissions'] = """
         SELECT path, permissions, uid, gid, mtime
         FROM file
         WHERE path LIKE '/etc/%'
         AND permissions LIKE '%w%'
         AND permissions LIKE '%-%-%w%'  -- world writable
-        """)
-        security['file_permissions'] = file_permissions
+        """
+        
+        security.update(self.query_many(sqls))
         
         return security
     
@@ -284,7 +521,7 @@ class OSQueryScanner:
         SELECT p.name, p.pid, p.cmdline
         FROM processes p
         JOIN process_open_files f ON p.pid = f.pid
-        WHERE f.path = '{changed_file}'
+        WHERE f.path = {_sql_quote(changed_file)}
         """)
         impact['affected_processes'] = affected_procs
         
@@ -311,28 +548,38 @@ class OSQueryScanner:
             'disk_io': [],
             'network_io': []
         }
+        sqls = {}
         
         # memory info
-        memory = self.query("SELECT * FROM memory_info")
-        metrics['memory_usage'] = memory
+        sqls['memory_usage'] = "SELECT * FROM memory_info"
         
         # cpu info
-        cpu = self.query("SELECT * FROM cpu_time")
-        metrics['cpu_usage'] = cpu
+        sqls['cpu_usage'] = "SELECT * FROM cpu_time"
         
         # disk stats
-        disk_stats = self.query("""
+        sqls['disk_io'] = """
         SELECT name, reads, writes, read_bytes, write_bytes, read_time, write_time
         FROM disk_stats
         WHERE name NOT LIKE 'loop%'
-        """)
-        metrics['disk_io'] = disk_stats
+        """
+        
+        metrics.update(self.query_many(sqls))
         
         return metrics
 
+# shared across scans so the osqueryd connection outlives a single scan
+_scanner = None
+
+def get_scanner() -> OSQueryScanner:
+    """the shared scanner, created on first use"""
+    global _scanner
+    if _scanner is None:
+        _scanner = OSQueryScanner()
+    return _scanner
+
 def scan_with_osquery() -> Dict[str, Any]:
     """main osquery scanning function with enhanced homelab focus"""
-    scanner = OSQueryScanner()
+    scanner = get_scanner()
     start_time = time.time()
     
     if not scanner.check_osquery_installed():
@@ -1,45 +1,263 @@
 #!/usr/bin/env python3
 # spider/scanners/remote.py
 
+import os
+import re
+import select
+import signal
 import subprocess
+import threading
+import time
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+def _parse_ndjson_py(raw):
+    # one json document per line, lines that don't parse are skipped
+    parsed = []
+    for line in raw.split(b"\n"):
+        # skip lines that can't be a json document without raising
+        if line and line[0] in b'{[':
+            try:
+                parsed.append(_json_loads(line))
+            except (ValueError, TypeError):
+                pass
+    return parsed
+
+# compiled parser for hosts with hundreds of containers, built with: cythonize -i spider/scanners/_fastparse.pyx
+try:
+    from ._fastparse import parse_ndjson
+except ImportError:
+    parse_ndjson = _parse_ndjson_py
+
+try:
+    import paramiko
+    PARAMIKO_AVAILABLE = True
+except ImportError:
+    PARAMIKO_AVAILABLE = False
+
+# connecting gets its own budget, then the whole probe script gets COMMAND_TIMEOUT
+# to run and is killed past it, or past this much output; keepalives only catch
+# dead hosts, a slow but healthy one still gets the full budget
+CONNECT_TIMEOUT = 20
+COMMAND_TIMEOUT = 60
+KEEPALIVE_INTERVAL = 5
+MAX_OUTPUT_BYTES = 4 * 1024 * 1024
+READ_CHUNK = 65536
+
+# (section, command) pairs run on every host in one remote shell
+PROBES = (
+    ('connection', "echo 'connection test'"),
+    ('hostname', "hostname"),
+    # casaos -v is kept in the shell so casaos_version doesn't run it again
+    ('casaos', "ls /etc/casaos && casaos_v=$(casaos -v) && echo \"$casaos_v\""),
+    ('os_release', "cat /etc/os-release"),
+    ('uptime', "uptime"),
+    ('memory', "free -h"),
+    ('load_average', "cat /proc/loadavg"),
+    ('cpu_info', "nproc && cat /proc/cpuinfo | grep 'model name' | head -1"),
+    ('df', "df -PB1"),
+    ('docker', "which docker"),
+    ('docker_containers', "command -v docker >/dev/null && docker ps -a --format '{{json .}}'"),
+    ('docker_stats', "command -v docker >/dev/null && docker system df --format '{{json .}}'"),
+    ('boot_id', "cat /proc/sys/kernel/random/boot_id"),
+    ('capabilities', "for tool in docker virsh lsblk; do command -v $tool >/dev/null && echo $tool; done; :"),
+)
+
+# probes that only feed classify_server_type, skipped once the type is cached
+DETECT_PROBES = {'casaos', 'os_release'}
+
+# server type barely ever changes, re-detect hourly
+SERVER_TYPE_TTL = 3600.0
+
+# probes that need a tool on the host, skipped while it's cached as absent
+PROBE_TOOLS = {
+    'docker_containers': 'docker',
+    'docker_stats': 'docker',
+    'casaos_apps': 'docker',
+    'homeassistant_vm': 'virsh',
+    'lsblk': 'lsblk',
+}
+
+# installed tools are re-checked every ten minutes, or sooner after a reboot
+CAPABILITY_TTL = 600.0
+
+# only run where casaos is installed
+CASAOS_PROBES = (
+    ('casaos_version', "echo \"${casaos_v:-$(casaos -v || echo unknown)}\""),
+    ('lsblk', "lsblk -J"),
+    ('casaos_apps', "docker ps --format '{{.Names}}\t{{.Status}}\t{{.Image}}'"),
+    ('homeassistant_vm', "virsh list --name | grep -i homeassistant || echo not_found"),
+)
+
+# every probe prints between a section header and its exit status
+_SECTION_RE = re.compile(rb'^---SECTION:(\w+)---\n(.*?)\n---STATUS:(\d+)---$', re.S | re.M)
+
+# sections only ever handed to a parser (json decoder or _OS_RE), kept as raw bytes
+RAW_SECTIONS = {'casaos', 'os_release', 'lsblk', 'docker_containers', 'docker_stats'}
+
+# distro names in /etc/os-release, matched on the raw bytes anywhere in the text;
+# when several appear the earliest in this order wins, not the earliest in the file
+OS_PRIORITY = ('ubuntu', 'debian', 'centos')
+_OS_RE = re.compile(rb'ubuntu|debian|centos', re.I)
+
+# per-filesystem fields from df, each a list in disk_info['filesystems']
+FILESYSTEM_COLUMNS = ('device', 'size', 'used', 'available', 'use_percent', 'mountpoint')
+
+# casaos partition kinds by exact mountpoint, then by a fragment anywhere in the path
+_PARTITION_EXACT = {
+    '/': 'system_root',
+    '/home': 'user_data',
+    '/DATA': 'user_data',
+    '/media': 'user_data',
+    '/boot': 'boot',
+}
+_PARTITION_PARTS = (('/var/lib', 'service_data'), ('/mnt', 'mount_point'))
+
+class _HostLogAdapter(logging.LoggerAdapter):
+    # prefixes every record with the host it's about, only once it will be emitted
+    def process(self, msg, kwargs):
+        return '[%s] %s' % (self.extra['host'], msg), kwargs
+
+def _communicate_capped(proc, stdin, timeout, limit):
+    # like communicate() but stops at a deadline or once output passes limit,
+    # returns (stdout, stderr, failure) with failure None on a clean exit
+    deadline = time.monotonic() + timeout
+    chunks = {proc.stdout: [], proc.stderr: []}
+    readers = [proc.stdout, proc.stderr]
+    writers = [proc.stdin] if stdin else []
+    total = 0
+    offset = 0
+    while readers or writers:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None, None, 'timed out'
+        readable, writable, _ = select.select(readers, writers, [], remaining)
+        for w in writable:
+            try:
+                offset += os.write(w.fileno(), stdin[offset:offset + READ_CHUNK])
+            except BrokenPipeError:
+                offset = len(stdin)
+            if offset >= len(stdin):
+                w.close()
+                writers = []
+        for r in readable:
+            chunk = os.read(r.fileno(), READ_CHUNK)
+            if not chunk:
+                readers.remove(r)
+                continue
+            chunks[r].append(chunk)
+            total += len(chunk)
+            if total > limit:
+                return None, None, f'output exceeded {limit} bytes'
+    remaining = max(deadline - time.monotonic(), 0)
+    try:
+        proc.wait(remaining)
+    except subprocess.TimeoutExpired:
+        return None, None, 'timed out'
+    return b''.join(chunks[proc.stdout]), b''.join(chunks[proc.stderr]), None
+
+def _probe_section(name, command):
+    # stderr is dropped so it can't interleave with the section text
+    return (f"echo '---SECTION:{name}---'\n"
+            f"{{ {command}\n}} 2>/dev/null\n"
+            f"printf '\\n---STATUS:%s---\\n' \"$?\"\n")
+
 class RemoteScanner:
+    # (host, user) -> (monotonic time, server type), shared by every scanner
+    _type_cache = {}
+    # (host, user) -> (monotonic time, boot id, frozenset of installed tools)
+    _caps_cache = {}
+
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # in-process ssh sessions when paramiko is installed, (host, user) -> client,
+        # None once a connect failed so that host keeps using the ssh binary
+        self._clients = {}
+        self._client_locks = {}
+        self._host_logs = {}
 
     def scan_remote_servers(self):
-        results = {}
-        for name, cfg in self.config.get('remote_servers', {}).items():
-            self.logger.info(f"Scanning remote server: {name} ({cfg['host']})")
-            try:
-                results[name] = self.scan_server(name, cfg)
-            except Exception as e:
-                self.logger.error(f"Failed to scan {name}: {e}")
-                results[name] = {'status': 'error', 'error': str(e)}
+        servers = self.config.get('remote_servers', {})
+        # keep config order, hosts finish in any order
+        results = dict.fromkeys(servers)
+        if not servers:
+            return results
+
+        # ssh is all network wait, so scan every host at once
+        try:
+            with ThreadPoolExecutor(max_workers=min(32, len(servers))) as pool:
+                futures = {}
+                for name, cfg in servers.items():
+                    futures[pool.submit(self.scan_server, name, cfg)] = name
+
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        self.logger.error("Failed to scan %s: %s", name, e)
+                        results[name] = {'status': 'error', 'error': str(e)}
+        finally:
+            self.close()
         return results
 
+    def close(self):
+        for client in self._clients.values():
+            if client is not None:
+                client.close()
+        self._clients.clear()
+
+    def _log(self, host):
+        # one adapter per host, reused across every command to it
+        log = self._host_logs.get(host)
+        if log is None:
+            log = self._host_logs.setdefault(host, _HostLogAdapter(self.logger, {'host': host}))
+        return log
+
     def scan_server(self, name, cfg):
         host, user = cfg['host'], cfg['user']
         key = cfg.get('ssh_key')
+        log = self._log(host)
+        log.info("Scanning remote server: %s", name)
 
-        # test connection
-        test = self.run_remote_command(host, user, "echo 'connection test'", ssh_key=key)
-        if not test or 'connection test' not in test:
+        # every probe in one round-trip, then parse each section locally
+        server_type = self._cached_server_type(host, user)
+        caps, boot_id = self._cached_capabilities(host, user)
+        output = self.run_remote_script(host, user, self._build_probe_script(server_type, caps), key)
+        sections = self.parse_probe_output(output) if output else {}
+        if 'connection test' not in (sections.get('connection') or ''):
             raise Exception("Connection failed")
 
-        server_type = self.detect_server_type(host, user, key)
-        hostname = (self.run_remote_command(host, user, "hostname", ssh_key=key) or name).strip()
+        current_boot = (sections.get('boot_id') or '').strip()
+        if caps is None:
+            self._remember_capabilities(host, user, current_boot, sections.get('capabilities'))
+        elif current_boot != boot_id:
+            # rebooted since the tools were checked, check again next scan
+            RemoteScanner._caps_cache.pop((host, user), None)
+            log.debug("Host rebooted, capabilities will be re-checked")
+
+        if server_type is None:
+            server_type = self.classify_server_type(sections.get('casaos'), sections.get('os_release'))
+            self._remember_server_type(host, user, server_type)
+            log.debug("Detected server type: %s", server_type)
+        hostname = (sections.get('hostname') or name).strip()
 
-        system_info = self.get_system_info(host, user, server_type, key)
-        disk_info = self.get_disk_info(host, user, server_type, key)
-        docker_info = self.get_docker_info(host, user, key)
+        system_info = self.get_system_info(sections, server_type)
+        disk_info = self.get_disk_info(sections.get('df'), server_type)
+        docker_info = self.get_docker_info(sections)
 
         if server_type == 'ubuntu_casaos':
-            system_info.update(self.get_casaos_specific_info(host, user, key))
+            system_info.update(self.get_casaos_specific_info(sections))
 
         return {
             'status': 'connected',
@@ -51,128 +269,260 @@ class RemoteScanner:
             'scan_time': datetime.now().isoformat()
         }
 
-    def detect_server_type(self, host, user, ssh_key=None):
-        casaos = self.run_remote_command(host, user, "ls /etc/casaos && casaos -v", ssh_key)
-        if casaos and '/etc/casaos' in casaos:
+    def _build_probe_script(self, server_type=None, caps=None):
+        # with a known server type the detection probes are skipped and the
+        # casaos probes are included or left out up front; with known caps,
+        # probes for tools the host doesn't have are skipped too
+        def wanted(name):
+            tool = PROBE_TOOLS.get(name)
+            return caps is None or tool is None or tool in caps
+
+        def sections(probes, skip=()):
+            return ''.join(_probe_section(name, command) for name, command in probes
+                           if name not in skip and wanted(name))
+
+        skip = {'capabilities'} if caps is not None else set()
+        if server_type is None:
+            script = sections(PROBES, skip)
+            script += "if command -v casaos >/dev/null 2>&1; then\n"
+            script += sections(CASAOS_PROBES)
+            script += "fi\n"
+            return script
+
+        script = sections(PROBES, skip | DETECT_PROBES)
+        if server_type == 'ubuntu_casaos':
+            script += sections(CASAOS_PROBES)
+        return script
+
+    def _cached_server_type(self, host, user):
+        hit = RemoteScanner._type_cache.get((host, user))
+        if hit and time.monotonic() - hit[0] < SERVER_TYPE_TTL:
+            return hit[1]
+        return None
+
+    def _remember_server_type(self, host, user, server_type):
+        RemoteScanner._type_cache[(host, user)] = (time.monotonic(), server_type)
+
+    def _cached_capabilities(self, host, user):
+        # (installed tools, boot id) while fresh, (None, None) when they need checking
+        hit = RemoteScanner._caps_cache.get((host, user))
+        if hit and time.monotonic() - hit[0] < CAPABILITY_TTL:
+            return hit[2], hit[1]
+        return None, None
+
+    def _remember_capabilities(self, host, user, boot_id, capabilities):
+        if capabilities is None:
+            return
+        caps = frozenset(capabilities.split())
+        RemoteScanner._caps_cache[(host, user)] = (time.monotonic(), boot_id, caps)
+
+    def parse_probe_output(self, output):
+        # section -> output, None where the probe exited non-zero; json sections
+        # stay bytes for the decoder, the rest are decoded to text
+        sections = {}
+        for name, body, status in _SECTION_RE.findall(output):
+            name = name.decode()
+            if status != b'0':
+                sections[name] = None
+            elif name in RAW_SECTIONS:
+                sections[name] = body
+            else:
+                sections[name] = body.decode(errors='replace')
+        return sections
+
+    def classify_server_type(self, casaos, os_release):
+        # both probes come in as raw bytes
+        if casaos and b'/etc/casaos' in casaos:
             return 'ubuntu_casaos'
 
-        os_release = self.run_remote_command(host, user, "cat /etc/os-release", ssh_key)
-        if os_release:
-            os_lower = os_release.lower()
-            if 'ubuntu' in os_lower:
-                return 'ubuntu'
-            elif 'debian' in os_lower:
-                return 'debian'
-            elif 'centos' in os_lower:
-                return 'centos'
-        return 'linux'
-
-    def get_casaos_specific_info(self, host, user, ssh_key=None):
+        found = {m.decode().lower() for m in _OS_RE.findall(os_release)} if os_release else ()
+        return min(found, key=OS_PRIORITY.index) if found else 'linux'
+
+    def get_casaos_specific_info(self, sections):
         info = {}
-        version = self.run_remote_command(host, user, "casaos -v || echo unknown", ssh_key)
+        version = sections.get('casaos_version')
         info['casaos_version'] = version.strip() if version else 'unknown'
 
-        lsblk = self.run_remote_command(host, user, "lsblk -J", ssh_key)
+        lsblk = sections.get('lsblk')
         if lsblk:
-            try:
-                info['block_devices'] = json.loads(lsblk)
-            except:
-                info['block_devices'] = {}
-
-        apps = self.run_remote_command(host, user,
-                                       "docker ps --format 'table {{.Names}}\t{{.Status}}\t{{.Image}}' || echo none",
-                                       ssh_key)
-        info['casaos_apps'] = apps.strip() if apps else 'none'
-
-        ha_vm = self.run_remote_command(host, user,
-                                        "virsh list --name | grep -i homeassistant || echo not_found",
-                                        ssh_key)
+            info['block_devices'] = {}
+            if lsblk[0] in b'{[':
+                try:
+                    info['block_devices'] = _json_loads(lsblk)
+                except (ValueError, TypeError):
+                    pass
+
+        # one tab separated name, status, image line per running app
+        apps = []
+        for line in (sections.get('casaos_apps') or '').splitlines():
+            parts = line.split('\t')
+            if len(parts) == 3:
+                apps.append({'name': parts[0], 'status': parts[1], 'image': parts[2]})
+        info['casaos_apps'] = apps
+
+        ha_vm = sections.get('homeassistant_vm')
         info['homeassistant_vm'] = 'running' if ha_vm and 'homeassistant' in ha_vm.lower() else 'not_found'
 
         return info
 
-    def get_disk_info(self, host, user, server_type, ssh_key=None):
-        df = self.run_remote_command(host, user, "df -h", ssh_key)
-        disks = []
+    def get_disk_info(self, df, server_type, include_raw=False):
+        # df -PB1 prints one posix line per filesystem with sizes in bytes,
+        # the raw text is only kept when include_raw is set for debugging.
+        # filesystems is columnar, one list per field, row i of every list is one filesystem
+        casaos = server_type == 'ubuntu_casaos'
+        cols = {k: [] for k in FILESYSTEM_COLUMNS}
+        if casaos:
+            cols['casaos_type'] = []
         if df:
-            for line in df.strip().split("\n")[1:]:
-                parts = line.split()
-                if len(parts) >= 6:
-                    fs = {
-                        'device': parts[0],
-                        'size': parts[1],
-                        'used': parts[2],
-                        'available': parts[3],
-                        'use_percent': parts[4],
-                        'mountpoint': parts[5]
-                    }
-                    if server_type == 'ubuntu_casaos':
-                        fs['casaos_type'] = self.classify_casaos_partition(parts[5])
-                    disks.append(fs)
-        return {'raw_output': df, 'filesystems': disks}
+            lines = iter(df.splitlines())
+            next(lines, None)  # header
+            for line in lines:
+                parts = line.split(None, 5)
+                if len(parts) != 6:
+                    continue
+                device, size, used, available, use_percent, mountpoint = parts
+                try:
+                    size, used, available = int(size), int(used), int(available)
+                except ValueError:
+                    continue
+                cols['device'].append(device)
+                cols['size'].append(size)
+                cols['used'].append(used)
+                cols['available'].append(available)
+                cols['use_percent'].append(use_percent)
+                cols['mountpoint'].append(mountpoint)
+                if casaos:
+                    cols['casaos_type'].append(self.classify_casaos_partition(mountpoint))
+        disk_info = {'filesystems': cols}
+        if include_raw:
+            disk_info['raw_output'] = df
+        return disk_info
 
     def classify_casaos_partition(self, mount):
-        if mount == '/':
-            return 'system_root'
-        elif mount in ['/home', '/DATA', '/media']:
-            return 'user_data'
-        elif '/var/lib' in mount:
-            return 'service_data'
-        elif mount == '/boot':
-            return 'boot'
-        elif '/mnt' in mount:
-            return 'mount_point'
-        else:
-            return 'other'
-
-    def get_system_info(self, host, user, server_type, ssh_key=None):
+        # exact mountpoints first, then the first fragment the path contains
+        return (_PARTITION_EXACT.get(mount)
+                or next((kind for part, kind in _PARTITION_PARTS if part in mount), 'other'))
+
+    def get_system_info(self, sections, server_type):
         info = {'server_type': server_type}
-        info['uptime'] = (self.run_remote_command(host, user, "uptime", ssh_key) or 'unknown').strip()
-        info['memory'] = (self.run_remote_command(host, user, "free -h", ssh_key) or 'unknown').strip()
-        info['load_average'] = (self.run_remote_command(host, user, "cat /proc/loadavg", ssh_key) or 'unknown').strip()
-        info['cpu_info'] = (self.run_remote_command(host, user,
-                                                    "nproc && cat /proc/cpuinfo | grep 'model name' | head -1",
-                                                    ssh_key) or 'unknown').strip()
+        for field in ('uptime', 'memory', 'load_average', 'cpu_info'):
+            info[field] = (sections.get(field) or 'unknown').strip()
         return info
 
-    def get_docker_info(self, host, user, ssh_key=None):
-        if not self.run_remote_command(host, user, "which docker", ssh_key):
+    def get_docker_info(self, sections):
+        if not sections.get('docker'):
             return {'status': 'not_installed'}
 
-        containers_raw = self.run_remote_command(host, user, "docker ps -a --format '{{json .}}'", ssh_key)
-        containers = []
-        if containers_raw:
-            for line in containers_raw.strip().split("\n"):
-                try:
-                    containers.append(json.loads(line))
-                except:
-                    pass
+        containers = parse_ndjson(sections.get('docker_containers') or b'')
 
-        stats_raw = self.run_remote_command(host, user, "docker system df --format '{{json .}}'", ssh_key)
+        stats_raw = sections.get('docker_stats')
         stats = {}
-        if stats_raw:
+        if stats_raw and stats_raw[0] in b'{[':
             try:
-                stats = json.loads(stats_raw)
-            except:
-                stats = {}
+                stats = _json_loads(stats_raw)
+            except (ValueError, TypeError):
+                pass
 
         return {'status': 'installed', 'containers': containers, 'stats': stats}
 
-    def run_remote_command(self, host, user, command, ssh_key=None):
-        ssh_cmd = ['ssh', '-o', 'StrictHostKeyChecking=no', '-o', 'ConnectTimeout=20']
+    def _ssh_base(self, host, user, ssh_key=None):
+        # batch mode fails instead of prompting, keepalives drop a half-open
+        # connection after two missed replies
+        ssh_cmd = ['ssh', '-o', 'StrictHostKeyChecking=no', '-o', f'ConnectTimeout={CONNECT_TIMEOUT}',
+                   '-o', 'BatchMode=yes',
+                   '-o', f'ServerAliveInterval={KEEPALIVE_INTERVAL}', '-o', 'ServerAliveCountMax=2']
         if ssh_key:
-            ssh_cmd += ['-i', ssh_key]
-        ssh_cmd += [f'{user}@{host}', command]
+            # only offer the configured key, not every key the agent holds
+            ssh_cmd += ['-o', 'IdentitiesOnly=yes', '-i', ssh_key]
+        return ssh_cmd
 
-        try:
-            result = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=60)
-            if result.returncode == 0:
-                return result.stdout
-            self.logger.error(f"SSH command failed: {result.stderr.strip()}")
+    def _client(self, host, user, ssh_key=None):
+        # one authenticated session per host, None means fall back to the ssh binary
+        if not PARAMIKO_AVAILABLE:
             return None
-        except subprocess.TimeoutExpired:
-            self.logger.error(f"SSH command timed out: {command}")
+
+        with self._lock:
+            host_lock = self._client_locks.setdefault((host, user), threading.Lock())
+        # connects to different hosts don't wait on each other
+        with host_lock:
+            if (host, user) not in self._clients:
+                try:
+                    client = paramiko.SSHClient()
+                    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                    client.connect(host, username=user, key_filename=ssh_key, timeout=CONNECT_TIMEOUT,
+                                   allow_agent=not ssh_key, look_for_keys=not ssh_key)
+                    client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+                except Exception as e:
+                    self._log(host).error("paramiko connect failed, using ssh: %s", e)
+                    client = None
+                self._clients[(host, user)] = client
+            return self._clients[(host, user)]
+
+    def _client_command(self, client, command, stdin=None):
+        # run over an open session, returns (exit status, stdout bytes, stderr bytes)
+        chan_in, chan_out, chan_err = client.exec_command(command, timeout=COMMAND_TIMEOUT)
+        if stdin is not None:
+            chan_in.write(stdin)
+        chan_in.channel.shutdown_write()
+        # read in chunks so a runaway command can't fill memory
+        chunks = []
+        total = 0
+        for chunk in iter(lambda: chan_out.read(READ_CHUNK), b''):
+            total += len(chunk)
+            if total > MAX_OUTPUT_BYTES:
+                chan_out.channel.close()
+                return None, None, f'output exceeded {MAX_OUTPUT_BYTES} bytes'.encode()
+            chunks.append(chunk)
+        stderr = chan_err.read(MAX_OUTPUT_BYTES)
+        return chan_out.channel.recv_exit_status(), b''.join(chunks), stderr
+
+    def run_remote_script(self, host, user, script, ssh_key=None):
+        # feed a whole script to a remote shell over stdin
+        return self.run_remote_command(host, user, "bash -s", ssh_key, stdin=script.encode(), binary=True)
+
+    def run_remote_command(self, host, user, command, ssh_key=None, stdin=None, binary=False):
+        # binary returns raw stdout bytes (and takes bytes stdin) for output that only
+        # goes to a parser, skipping the utf-8 decode
+        log = self._log(host)
+        client = self._client(host, user, ssh_key)
+        if client is not None:
+            try:
+                status, stdout, stderr = self._client_command(client, command, stdin)
+                if status == 0:
+                    return stdout if binary else stdout.decode(errors='replace')
+                log.error("SSH command failed: %s", stderr.decode(errors='replace').strip())
+                return None
+            except Exception as e:
+                log.error("SSH command error: %s", e)
+                return None
+
+        ssh_cmd = self._ssh_base(host, user, ssh_key) + [f'{user}@{host}', command]
+
+        try:
+            # own session so a timeout takes down ssh and anything it spawned;
+            # ssh gets /dev/null as stdin unless a script is fed, never ours
+            proc = subprocess.Popen(ssh_cmd,
+                                    stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    start_new_session=True)
+            try:
+                # streamed with a byte cap, a rogue host can't balloon memory; the
+                # ssh binary connects inside this deadline, so it covers both budgets
+                stdout, stderr, failure = _communicate_capped(proc, stdin, CONNECT_TIMEOUT + COMMAND_TIMEOUT,
+                                                              MAX_OUTPUT_BYTES)
+                if failure:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    log.error("SSH command %s: %s", failure, command)
+                    return None
+            finally:
+                for pipe in (proc.stdin, proc.stdout, proc.stderr):
+                    if pipe:
+                        pipe.close()
+            if proc.returncode == 0:
+                return stdout if binary else stdout.decode(errors='replace')
+            log.error("SSH command failed: %s", stderr.decode(errors='replace').strip())
             return None
         except Exception as e:
-            self.logger.error(f"SSH command error: {e}")
+            log.error("SSH command error: %s", e)
             return None
@@ -9,28 +9,217 @@ provides graph operations for file dependency analysis and change tracking
 
 import sys
 import os
+import functools
 import json
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, List, Any, Optional, Set
 from pathlib import Path
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# compiled statements kept per connection, every query below is a fixed
+# literal so repeat calls skip parsing and planning
+CACHED_STATEMENTS = 256
+
+# INSERT ... ON CONFLICT needs sqlite 3.24, older libraries take the slower path
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+# ensure-exists inserts leave an existing row alone, upserts keep the row (and its
+# id) and only overwrite the fields that were supplied
+if HAS_UPSERT:
+    _ENSURE_FILE_SQL = """INSERT INTO files (path, file_type, created_time) VALUES (?, ?, ?)
+                          ON CONFLICT(path) DO NOTHING"""
+    _UPSERT_FILE_SQL = """INSERT INTO files 
+                          (path, file_type, size, modified_time, created_time, content_hash)
+                          VALUES (?, ?, ?, ?, ?, ?)
+                          ON CONFLICT(path) DO UPDATE SET
+                              file_type = excluded.file_type,
+                              size = COALESCE(excluded.size, size),
+                              modified_time = COALESCE(excluded.modified_time, modified_time),
+                              content_hash = COALESCE(excluded.content_hash, content_hash)"""
+else:
+    _ENSURE_FILE_SQL = "INSERT OR IGNORE INTO files (path, file_type, created_time) VALUES (?, ?, ?)"
+    _UPSERT_FILE_SQL = """INSERT OR REPLACE INTO files 
+                          (path, file_type, size, modified_time, created_time, content_hash)
+                          VALUES (?, ?, ?, ?, ?, ?)"""
+
+# RETURNING (sqlite 3.35+) hands back the row id from the insert itself; on older
+# libraries the statements return nothing and the id is looked up afterwards
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+_RETURNING_ID = " RETURNING id" if HAS_RETURNING else ""
+_ENSURE_FILE_ID_SQL = _ENSURE_FILE_SQL + _RETURNING_ID
+_UPSERT_FILE_ID_SQL = _UPSERT_FILE_SQL + _RETURNING_ID
+
+# path -> id lookups kept in memory, least recently used dropped first
+FILE_ID_CACHE_SIZE = 4096
+
+# snapshots are stored as sqlite's binary jsonb where the library has it (3.45+),
+# read them back through json(data_json), which takes either form
+HAS_JSONB = sqlite3.sqlite_version_info >= (3, 45, 0)
+_SNAPSHOT_VALUE = 'jsonb(?)' if HAS_JSONB else '?'
+
+# with zstandard installed snapshots are stored as zstd-compressed json instead,
+# told apart from older rows by the frame magic
+SNAPSHOT_ZSTD_LEVEL = 3
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def _encode_metadata(metadata):
+    # relationship metadata as msgpack bytes when available, json text otherwise
+    if not metadata:
+        return None
+    return msgpack.packb(metadata) if MSGPACK_AVAILABLE else _json_dumps(metadata)
+
+def _decode_metadata(value):
+    # older rows and hosts without msgpack store json text, msgpack rows are bytes
+    if not value:
+        return {}
+    if isinstance(value, bytes):
+        if not MSGPACK_AVAILABLE:
+            raise RuntimeError("relationship metadata is msgpack encoded, msgpack is not installed")
+        return msgpack.unpackb(value)
+    return _json_loads(value)
+
+# substring path search runs off an fts5 trigram index (sqlite 3.34+), which
+# needs at least three characters to look anything up
+HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+MIN_TRIGRAM_PATTERN = 3
+
+# a write still locked out after busy_timeout is retried a few times with
+# exponential backoff, anything else is raised to the caller
+BUSY_RETRIES = 4
+BUSY_BACKOFF = 0.01
+
+def _is_busy(error):
+    # sqlite reports SQLITE_BUSY and SQLITE_LOCKED as "... is locked"
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+# sqlite's default host parameter limit on older builds, IN (...) lookups are chunked to it
+MAX_SQL_PARAMS = 999
+
+# applied on every open; wal lets readers run alongside a writer and with
+# synchronous=NORMAL a commit only fsyncs at checkpoints. page_size only takes
+# on a new database, so it goes before wal is switched on; an existing file
+# keeps its page size until a VACUUM. the mmap window only speeds up reads,
+# which is everything this module does outside of ingestion
+CONNECTION_PRAGMAS = (
+    "PRAGMA page_size=8192",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-64000",  # 64 MB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA foreign_keys = ON",
+)
+
+# read-only connections share the per-connection tuning and refuse writes
+READER_PRAGMAS = (
+    "PRAGMA cache_size=-64000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA query_only=1",
+)
+
+# read-only connections kept open for queries, so threads can read concurrently
+READ_POOL_SIZE = 8
+
+# seconds a reader waits for a pooled connection before giving up; the iter_*
+# methods hold theirs until they're exhausted or closed, so leaked generators
+# show up here instead of as a hang
+READ_POOL_TIMEOUT = 30.0
+
+# the background writer commits a batch once it holds this many queued writes
+# or the first one has waited this long
+WRITE_BATCH_SIZE = 1000
+WRITE_FLUSH_INTERVAL = 0.2
+
+def _write_method(method):
+    # with a background writer, calls from any other thread are queued for it and
+    # return None instead of touching the connection the writer owns
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._writer is not None and threading.current_thread() is not self._writer:
+            self._queue_write(method, (self,) + args, kwargs)
+            return None
+        return method(self, *args, **kwargs)
+    return wrapper
+
 class KnowledgeGraphDB:
     # sqlite-based storage for file relationships and system snapshots
     
-    def __init__(self, db_path="data/archive/spider_knowledge.db"):
+    def __init__(self, db_path="data/archive/spider_knowledge.db", background_writer=False):
         self.db_path = db_path
         self.conn = None
-        self._initialize_database()
-        
-    def _initialize_database(self):
+        # one timestamp for every row written inside a transaction() block
+        self._batch_time = None
+        # writes queued by a transaction() block on a thread other than the writer's
+        self._local = threading.local()
+        # path -> file id, oldest first; shared with the writer thread
+        self._id_cache = OrderedDict()
+        self._id_lock = threading.Lock()
+        # only ever used by whichever thread writes through self.conn
+        self._zstd = zstandard.ZstdCompressor(level=SNAPSHOT_ZSTD_LEVEL) if ZSTD_AVAILABLE else None
+        self._initialize_database(background_writer)
+        
+        # queries check a read-only connection out of the pool
+        self._ro_pool = queue.Queue()
+        for _ in range(READ_POOL_SIZE):
+            self._ro_pool.put(self._open_reader())
+        
+        # with a background writer, self.conn belongs to the writer thread
+        self._writes = None
+        self._writer = None
+        if background_writer:
+            self._writes = queue.Queue()
+            self._writer = threading.Thread(target=self._writer_loop, name='knowledge-graph-writer', daemon=True)
+            self._writer.start()
+        
+    def _initialize_database(self, background_writer=False):
         # create database schema if needed
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
         
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute("PRAGMA foreign_keys = ON")
+        # the writer thread takes this connection over, so it can't be pinned here
+        self.conn = sqlite3.connect(self.db_path, cached_statements=CACHED_STATEMENTS,
+                                    check_same_thread=not background_writer)
+        # without a background writer only this thread can use self.conn, so it
+        # owns any transaction open on it
+        self._conn_owner = threading.get_ident()
+        # rows take index or column-name access without building a dict each
+        self.conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            self.conn.execute(pragma)
         
         # create main tables
         self.conn.executescript("""
@@ -41,7 +230,8 @@ class KnowledgeGraphDB:
             size INTEGER,
             modified_time REAL,
             created_time TEXT,
-            content_hash TEXT
+            content_hash TEXT,
+            connection_count INTEGER DEFAULT 0
         );
         
         CREATE TABLE IF NOT EXISTS relationships (
@@ -76,289 +266,720 @@ class KnowledgeGraphDB:
         );
         
         CREATE INDEX IF NOT EXISTS idx_file_path ON files(path);
-        CREATE INDEX IF NOT EXISTS idx_relationship_source ON relationships(source_file_id);
+        -- covering indexes for each direction, outgoing and incoming lookups never
+        -- touch the table; they replace the old source-only index
+        DROP INDEX IF EXISTS idx_relationship_source;
+        CREATE INDEX IF NOT EXISTS idx_rel_src_cov ON relationships(source_file_id, target_file_id, relationship_type, strength);
+        CREATE INDEX IF NOT EXISTS idx_rel_tgt_cov ON relationships(target_file_id, source_file_id, relationship_type, strength);
         CREATE INDEX IF NOT EXISTS idx_relationship_type ON relationships(relationship_type);
         CREATE INDEX IF NOT EXISTS idx_changes_time ON file_changes(timestamp);
         """)
+        self._add_connection_counts()
+        self._path_index = HAS_TRIGRAM and self._create_path_index()
         
+        # refresh planner statistics so the covering indexes get picked, the
+        # analysis limit keeps this cheap on a large database
+        self.conn.execute("PRAGMA analysis_limit=400")
+        self.conn.execute("PRAGMA optimize")
         self.conn.commit()
     
+    def _add_connection_counts(self):
+        # files.connection_count is kept by triggers on relationships, so ranking
+        # files never has to count the relationships table
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if 'connection_count' not in columns:
+            self.conn.execute("ALTER TABLE files ADD COLUMN connection_count INTEGER DEFAULT 0")
+            # a file that references itself counts once, same as the triggers
+            self.conn.execute("""
+                UPDATE files SET connection_count =
+                    (SELECT COUNT(*) FROM relationships r WHERE r.source_file_id = files.id) +
+                    (SELECT COUNT(*) FROM relationships r
+                     WHERE r.target_file_id = files.id AND r.source_file_id IS NOT files.id)
+            """)
+        
+        self.conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS trg_rel_insert AFTER INSERT ON relationships BEGIN
+            UPDATE files SET connection_count = connection_count + 1
+            WHERE id IN (new.source_file_id, new.target_file_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rel_delete AFTER DELETE ON relationships BEGIN
+            UPDATE files SET connection_count = connection_count - 1
+            WHERE id IN (old.source_file_id, old.target_file_id);
+        END;
+        
+        CREATE INDEX IF NOT EXISTS idx_files_conn ON files(connection_count DESC);
+        """)
+    
+    def _create_path_index(self):
+        # external content fts5 table over files.path kept in step by triggers,
+        # False when this sqlite was built without fts5
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"
+        ).fetchone()
+        try:
+            self.conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                path, content='files', content_rowid='id', tokenize='trigram'
+            );
+            
+            CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+                INSERT INTO files_fts (rowid, path) VALUES (new.id, new.path);
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, path) VALUES ('delete', old.id, old.path);
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF path ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, path) VALUES ('delete', old.id, old.path);
+                INSERT INTO files_fts (rowid, path) VALUES (new.id, new.path);
+            END;
+            """)
+        except sqlite3.OperationalError:
+            return False
+        
+        # index the rows of a database that predates the table
+        if not exists:
+            self.conn.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+        return True
+    
+    @contextmanager
+    def transaction(self):
+        # group writes into one commit, joins a transaction that's already open.
+        # off the background writer's thread the block's writes are collected and
+        # queued as one item, so the writer applies them together or not at all
+        if self._writer is not None and threading.current_thread() is not self._writer:
+            if getattr(self._local, 'pending', None) is not None:
+                yield
+                return
+            pending = self._local.pending = []
+            try:
+                yield
+            finally:
+                self._local.pending = None
+            if pending:
+                self._writes.put((self._run_writes, (pending,), {}))
+            return
+        if self.conn.in_transaction:
+            yield
+            return
+        self.conn.execute("BEGIN")
+        self._batch_time = datetime.now().isoformat()
+        try:
+            yield
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            # ids handed out inside the block may belong to rows that are gone now
+            with self._id_lock:
+                self._id_cache.clear()
+            raise
+        finally:
+            self._batch_time = None
+    
+    def _timestamp(self):
+        # the transaction's timestamp, or a fresh one for a lone write
+        return self._batch_time or datetime.now().isoformat()
+    
+    def flush(self):
+        # commit writes made outside a transaction() block, or wait until the
+        # background writer has committed everything queued so far
+        if self._writer is None:
+            self.conn.commit()
+            return
+        done = threading.Event()
+        self._writes.put(done)
+        done.wait()
+    
+    def _open_reader(self):
+        conn = sqlite3.connect(Path(self.db_path).absolute().as_uri() + '?mode=ro', uri=True,
+                               cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in READER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def _checkout(self):
+        # uncommitted writes are only visible on self.conn, so the thread that
+        # owns it reads there while it has a transaction open; every other
+        # thread reads from the pool
+        if (self._writer is None and threading.get_ident() == self._conn_owner
+                and self.conn.in_transaction):
+            yield self.conn
+            return
+        try:
+            conn = self._ro_pool.get(timeout=READ_POOL_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError(
+                f"no read connection free after {READ_POOL_TIMEOUT}s, all {READ_POOL_SIZE} are "
+                "checked out (an unfinished iter_* generator keeps its connection until it's "
+                "exhausted or closed)"
+            ) from None
+        try:
+            yield conn
+        finally:
+            self._ro_pool.put(conn)
+    
+    def submit(self, fn, *args, **kwargs):
+        # run a write on the background writer and return at once, or run it in
+        # its own transaction right here when there's no writer
+        if self._writer is None:
+            with self.transaction():
+                return fn(*args, **kwargs)
+        self._queue_write(fn, args, kwargs)
+    
+    def _queue_write(self, fn, args, kwargs):
+        # onto the open transaction() block's batch if there is one, else the queue
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append((fn, args, kwargs))
+        else:
+            self._writes.put((fn, args, kwargs))
+    
+    @staticmethod
+    def _run_writes(writes):
+        for fn, args, kwargs in writes:
+            fn(*args, **kwargs)
+    
+    def _writer_loop(self):
+        # owns self.conn; drains queued writes, one transaction per batch
+        stopping = False
+        while not stopping:
+            writes = []
+            waiters = []
+            item = self._writes.get()
+            deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                writes.append(item)
+                remaining = deadline - time.monotonic()
+                if len(writes) >= WRITE_BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    item = self._writes.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            
+            if writes:
+                try:
+                    self._apply_writes(writes)
+                except Exception:
+                    logger.exception("knowledge graph batch failed, %d writes lost", len(writes))
+            for done in waiters:
+                done.set()
+    
+    def _apply_writes(self, writes):
+        # a failing write is rolled back to its savepoint, the rest of the batch commits
+        with self.transaction():
+            for fn, args, kwargs in writes:
+                self.conn.execute("SAVEPOINT queued_write")
+                try:
+                    fn(*args, **kwargs)
+                except Exception:
+                    self.conn.execute("ROLLBACK TO queued_write")
+                    # ids the write cached may belong to rows that are gone now
+                    with self._id_lock:
+                        self._id_cache.clear()
+                    logger.exception("knowledge graph write failed")
+                self.conn.execute("RELEASE queued_write")
+    
+    @_write_method
     def add_file_record(self, path, file_type=None, size=None, modified_time=None, content_hash=None):
-        # add or update file in database
+        # add or update file in database, committed by transaction() or flush();
+        # without any metadata this only makes sure the row exists
+        if file_type is None and size is None and modified_time is None and content_hash is None:
+            return self.ensure_file(path)
+        return self.upsert_file(path, file_type, size, modified_time, content_hash)
+    
+    @_write_method
+    def ensure_file(self, path):
+        # id of the file row for path, created bare if missing and never rewritten
+        file_id = self._cached_file_id(path)
+        if file_id is not None:
+            return file_id
+        # DO NOTHING returns no row when the file was already there
+        rows = self.conn.execute(_ENSURE_FILE_ID_SQL,
+                                 (path, Path(path).suffix.lstrip('.'), self._timestamp())).fetchall()
+        if rows:
+            self._cache_file_id(path, rows[0][0])
+            return rows[0][0]
+        return self._get_file_id(path)
+    
+    @_write_method
+    def upsert_file(self, path, file_type=None, size=None, modified_time=None, content_hash=None):
+        # insert or update the file row for path in place, returns its id
         if file_type is None:
             file_type = Path(path).suffix.lstrip('.')
-            
-        cursor = self.conn.execute(
-            """INSERT OR REPLACE INTO files 
-               (path, file_type, size, modified_time, created_time, content_hash)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (path, file_type, size, modified_time, datetime.now().isoformat(), content_hash)
+        if not HAS_UPSERT:
+            # INSERT OR REPLACE gives the row a new id
+            with self._id_lock:
+                self._id_cache.pop(path, None)
+        rows = self.conn.execute(_UPSERT_FILE_ID_SQL,
+                                 (path, file_type, size, modified_time, self._timestamp(), content_hash)).fetchall()
+        if rows:
+            self._cache_file_id(path, rows[0][0])
+            return rows[0][0]
+        return self._get_file_id(path)
+    
+    @_write_method
+    def add_file_records_bulk(self, rows):
+        # add or update many files in one transaction, rows are
+        # (path, file_type, size, modified_time, content_hash) tuples
+        with self.transaction():
+            self._upsert_files(rows)
+    
+    @_write_method
+    def add_relationships_bulk(self, edges):
+        # create many (source_path, target_path, rel_type) relationships in one
+        # transaction, both ends must already be file records; edges to a path
+        # without one are skipped
+        with self.transaction():
+            self._insert_relationships(edges)
+    
+    def _ensure_files(self, paths):
+        now = self._timestamp()
+        self.conn.executemany(_ENSURE_FILE_SQL, [(path, Path(path).suffix.lstrip('.'), now) for path in paths])
+    
+    def _upsert_files(self, rows):
+        now = self._timestamp()
+        rows = [(path, Path(path).suffix.lstrip('.') if file_type is None else file_type,
+                 size, modified_time, now, content_hash)
+                for path, file_type, size, modified_time, content_hash in rows]
+        if not HAS_UPSERT:
+            # INSERT OR REPLACE gives the rows new ids
+            with self._id_lock:
+                for row in rows:
+                    self._id_cache.pop(row[0], None)
+        self.conn.executemany(_UPSERT_FILE_SQL, rows)
+    
+    def _insert_relationships(self, edges):
+        now = self._timestamp()
+        ids = self._get_file_ids({path for edge in edges for path in edge[:2]})
+        rows = [(ids[source], ids[target], rel_type, now)
+                for source, target, rel_type in edges
+                if source in ids and target in ids]
+        if len(rows) < len(edges):
+            logger.warning("skipped %d relationships to paths with no file record", len(edges) - len(rows))
+        self.conn.executemany(
+            """INSERT OR REPLACE INTO relationships 
+               (source_file_id, target_file_id, relationship_type, strength, metadata, discovered_time)
+               VALUES (?, ?, ?, 1.0, NULL, ?)""",
+            rows
         )
-        
-        self.conn.commit()
-        return cursor.lastrowid
     
+    @_write_method
     def add_file_relationship(self, source_path, target_path, rel_type, strength=1.0, metadata=None):
-        # create relationship between two files
+        # create relationship between two files, committed by transaction() or flush()
+        metadata_json = _encode_metadata(metadata)
+        now = self._timestamp()
         
-        # ensure both files exist
-        source_id = self.add_file_record(source_path)
-        target_id = self.add_file_record(target_path)
+        if HAS_UPSERT:
+            # both endpoints in one multi-row ensure-exists insert, then the edge
+            # straight from their paths
+            self.conn.execute(
+                """INSERT INTO files (path, file_type, created_time)
+                   VALUES (?, ?, ?), (?, ?, ?)
+                   ON CONFLICT(path) DO NOTHING""",
+                (source_path, Path(source_path).suffix.lstrip('.'), now,
+                 target_path, Path(target_path).suffix.lstrip('.'), now)
+            )
+            self.conn.execute(
+                """INSERT OR REPLACE INTO relationships 
+                   (source_file_id, target_file_id, relationship_type, strength, metadata, discovered_time)
+                   SELECT s.id, t.id, ?, ?, ?, ?
+                   FROM files s, files t
+                   WHERE s.path = ? AND t.path = ?""",
+                (rel_type, strength, metadata_json, now, source_path, target_path)
+            )
+            return
         
-        metadata_json = json.dumps(metadata) if metadata else None
+        # ensure both files exist
+        source_id = self.ensure_file(source_path)
+        target_id = self.ensure_file(target_path)
         
         self.conn.execute(
             """INSERT OR REPLACE INTO relationships 
                (source_file_id, target_file_id, relationship_type, strength, metadata, discovered_time)
                VALUES (?, ?, ?, ?, ?, ?)""",
-            (source_id, target_id, rel_type, strength, metadata_json, datetime.now().isoformat())
+            (source_id, target_id, rel_type, strength, metadata_json, now)
         )
-        
-        self.conn.commit()
     
+    @_write_method
     def store_system_snapshot(self, snapshot_data):
-        # store complete system snapshot
+        # store complete system snapshot, committed by transaction() or flush()
         snapshot_id = snapshot_data.get('scan_id', f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
         
-        try:
-            self.conn.execute(
-                """INSERT OR REPLACE INTO system_snapshots 
-                   (snapshot_id, timestamp, hostname, scan_type, data_json)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (snapshot_id, 
-                 snapshot_data.get('timestamp', datetime.now().isoformat()),
-                 snapshot_data.get('hostname', 'unknown'),
-                 snapshot_data.get('scan_type', 'unknown'),
-                 json.dumps(snapshot_data))
-            )
+        data_json = _json_dumps(snapshot_data)
+        if self._zstd is not None:
+            data_value = '?'
+            data_json = self._zstd.compress(data_json.encode())
+        else:
+            data_value = _SNAPSHOT_VALUE
+        
+        for attempt in range(BUSY_RETRIES):
+            try:
+                self.conn.execute(
+                    f"""INSERT OR REPLACE INTO system_snapshots 
+                       (snapshot_id, timestamp, hostname, scan_type, data_json)
+                       VALUES (?, ?, ?, ?, {data_value})""",
+                    (snapshot_id, 
+                     snapshot_data.get('timestamp') or self._timestamp(),
+                     snapshot_data.get('hostname', 'unknown'),
+                     snapshot_data.get('scan_type', 'unknown'),
+                     data_json)
+                )
+                return True
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == BUSY_RETRIES - 1:
+                    raise
+                time.sleep(BUSY_BACKOFF * 2 ** attempt)
+    
+    def get_snapshot(self, snapshot_id):
+        # stored snapshot data, None when there's no such snapshot; zstd rows come
+        # back as bytes, jsonb rows as json text and text rows untouched, since
+        # json() rejects the NaN/Infinity that _json_loads accepts
+        with self._checkout() as conn:
+            row = conn.execute("""
+                SELECT CASE WHEN substr(data_json, 1, 4) = ? THEN data_json
+                            WHEN typeof(data_json) = 'blob' THEN json(data_json)
+                            ELSE data_json END
+                FROM system_snapshots
+                WHERE snapshot_id = ?
+            """, (_ZSTD_MAGIC, snapshot_id)).fetchone()
+        if row is None:
+            return None
+        data = row[0]
+        if isinstance(data, bytes):
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError(f"snapshot {snapshot_id} is zstd compressed, zstandard is not installed")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return _json_loads(data)
+    
+    def get_file_connections(self, file_path, max_depth=2, include_metadata=False):
+        # get all connections for a specific file; metadata is only read and
+        # parsed when asked for, without it both lookups are index-only
+        with self._checkout() as conn:
+            file_id = self._get_file_id(file_path, conn)
+            if not file_id:
+                return {'error': 'file not found'}
             
-            self.conn.commit()
-            return True
-        except Exception:
-            return False
+            connections = {
+                'file': file_path,
+                'outgoing': [],  # files this references
+                'incoming': [],  # files that reference this
+                'related_files': set()
+            }
+            
+            # get outgoing relationships
+            if include_metadata:
+                cursor = conn.execute("""
+                    SELECT f.path, r.relationship_type, r.strength, r.metadata
+                    FROM relationships r
+                    JOIN files f ON f.id = r.target_file_id
+                    WHERE r.source_file_id = ?
+                """, (file_id,))
+            else:
+                cursor = conn.execute("""
+                    SELECT f.path, r.relationship_type, r.strength
+                    FROM relationships r
+                    JOIN files f ON f.id = r.target_file_id
+                    WHERE r.source_file_id = ?
+                """, (file_id,))
+            
+            for row in cursor:
+                connection = {'target': row[0], 'type': row[1], 'strength': row[2]}
+                if include_metadata:
+                    connection['metadata'] = _decode_metadata(row[3])
+                connections['outgoing'].append(connection)
+                connections['related_files'].add(row[0])
+            
+            # get incoming relationships
+            if include_metadata:
+                cursor = conn.execute("""
+                    SELECT f.path, r.relationship_type, r.strength, r.metadata
+                    FROM relationships r
+                    JOIN files f ON f.id = r.source_file_id
+                    WHERE r.target_file_id = ?
+                """, (file_id,))
+            else:
+                cursor = conn.execute("""
+                    SELECT f.path, r.relationship_type, r.strength
+                    FROM relationships r
+                    JOIN files f ON f.id = r.source_file_id
+                    WHERE r.target_file_id = ?
+                """, (file_id,))
+            
+            for row in cursor:
+                connection = {'source': row[0], 'type': row[1], 'strength': row[2]}
+                if include_metadata:
+                    connection['metadata'] = _decode_metadata(row[3])
+                connections['incoming'].append(connection)
+                connections['related_files'].add(row[0])
+            
+            # convert set to list
+            connections['related_files'] = list(connections['related_files'])
+            return connections
     
-    def get_file_connections(self, file_path, max_depth=2):
-        # get all connections for a specific file
-        file_id = self._get_file_id(file_path)
-        if not file_id:
-            return {'error': 'file not found'}
-        
-        connections = {
-            'file': file_path,
-            'outgoing': [],  # files this references
-            'incoming': [],  # files that reference this
-            'related_files': set()
-        }
-        
-        # get outgoing relationships
-        cursor = self.conn.execute("""
-            SELECT f.path, r.relationship_type, r.strength, r.metadata
-            FROM relationships r
-            JOIN files f ON f.id = r.target_file_id
-            WHERE r.source_file_id = ?
-        """, (file_id,))
-        
-        for path, rel_type, strength, metadata in cursor:
-            connections['outgoing'].append({
-                'target': path,
-                'type': rel_type,
-                'strength': strength,
-                'metadata': json.loads(metadata) if metadata else {}
-            })
-            connections['related_files'].add(path)
-        
-        # get incoming relationships
-        cursor = self.conn.execute("""
-            SELECT f.path, r.relationship_type, r.strength, r.metadata
-            FROM relationships r
-            JOIN files f ON f.id = r.source_file_id
-            WHERE r.target_file_id = ?
-        """, (file_id,))
-        
-        for path, rel_type, strength, metadata in cursor:
-            connections['incoming'].append({
-                'source': path,
-                'type': rel_type,
-                'strength': strength,
-                'metadata': json.loads(metadata) if metadata else {}
-            })
-            connections['related_files'].add(path)
-        
-        # convert set to list
-        connections['related_files'] = list(connections['related_files'])
-        return connections
-    
-    def find_connected_files(self, file_path, relationship_types=None):
-        # find all files connected to given file
-        file_id = self._get_file_id(file_path)
-        if not file_id:
-            return []
-        
-        type_filter = ""
-        params = [file_id, file_id]
-        
-        if relationship_types:
-            placeholders = ','.join('?' * len(relationship_types))
-            type_filter = f"AND r.relationship_type IN ({placeholders})"
-            params.extend(relationship_types)
-        
-        query = f"""
-            SELECT DISTINCT f.path
-            FROM relationships r
-            JOIN files f ON (f.id = r.target_file_id OR f.id = r.source_file_id)
-            WHERE (r.source_file_id = ? OR r.target_file_id = ?)
-            AND f.id != ?
-            {type_filter}
-        """
-        params.append(file_id)
-        
-        cursor = self.conn.execute(query, params)
-        return [row[0] for row in cursor]
+    def find_connected_files(self, file_path, relationship_types=None, max_depth=1):
+        # find all files within max_depth hops of given file, in either direction;
+        # the whole walk is one recursive query
+        with self._checkout() as conn:
+            file_id = self._get_file_id(file_path, conn)
+            if not file_id:
+                return []
+            
+            # the type filter is a json array parameter, NULL for every type, so the
+            # sql text never changes and stays in the statement cache
+            types_json = json.dumps(list(relationship_types)) if relationship_types else None
+            
+            # UNION drops repeat (file, depth) rows, so cycles can't blow up a level
+            cursor = conn.execute("""
+                WITH RECURSIVE reach(id, depth) AS (
+                    SELECT ?, 0
+                    UNION
+                    SELECT CASE WHEN r.source_file_id = reach.id THEN r.target_file_id ELSE r.source_file_id END,
+                           reach.depth + 1
+                    FROM reach
+                    JOIN relationships r ON (r.source_file_id = reach.id OR r.target_file_id = reach.id)
+                    WHERE reach.depth < ?
+                    AND (? IS NULL OR r.relationship_type IN (SELECT value FROM json_each(?)))
+                )
+                SELECT DISTINCT f.path
+                FROM reach
+                JOIN files f ON f.id = reach.id
+                WHERE reach.id != ?
+            """, (file_id, max_depth, types_json, types_json, file_id))
+            return [row[0] for row in cursor]
     
     def get_most_connected_files(self, limit=10):
         # find files with highest connection counts
-        cursor = self.conn.execute("""
-            SELECT f.path, f.file_type, COUNT(r.id) as connection_count
-            FROM files f
-            LEFT JOIN relationships r ON (f.id = r.source_file_id OR f.id = r.target_file_id)
-            GROUP BY f.id, f.path, f.file_type
-            ORDER BY connection_count DESC
-            LIMIT ?
-        """, (limit,))
-        
-        return [
-            {'path': path, 'type': file_type, 'connections': count}
-            for path, file_type, count in cursor
-        ]
+        return [dict(row) for row in self.iter_most_connected_files(limit)]
+    
+    def iter_most_connected_files(self, limit=10):
+        # stream rows with path, type and connections, holding a pooled connection
+        # until the generator is exhausted or closed; the counts are kept on the
+        # file rows, so this is the first few entries of idx_files_conn
+        with self._checkout() as conn:
+            cursor = conn.execute("""
+                SELECT path, file_type as type, connection_count as connections
+                FROM files
+                ORDER BY connection_count DESC
+                LIMIT ?
+            """, (limit,))
+            yield from cursor
     
     def search_files_by_pattern(self, pattern, file_type=None):
         # search files by path pattern
-        query = "SELECT path, file_type, size, modified_time FROM files WHERE path LIKE ?"
-        params = [f"%{pattern}%"]
-        
-        if file_type:
-            query += " AND file_type = ?"
-            params.append(file_type)
-        
-        cursor = self.conn.execute(query, params)
-        return [
-            {'path': path, 'type': ftype, 'size': size, 'modified': mtime}
-            for path, ftype, size, mtime in cursor
-        ]
+        return [dict(row) for row in self.iter_files_by_pattern(pattern, file_type)]
+    
+    def iter_files_by_pattern(self, pattern, file_type=None):
+        # stream rows with path, type, size and modified, holding a pooled connection
+        # until the generator is exhausted or closed; LIKE on the trigram table
+        # keeps LIKE's matching rules but is answered from the index instead of a full scan
+        file_type = file_type or None
+        with self._checkout() as conn:
+            if self._path_index and len(pattern) >= MIN_TRIGRAM_PATTERN:
+                cursor = conn.execute("""
+                    SELECT f.path, f.file_type as type, f.size, f.modified_time as modified
+                    FROM files_fts
+                    JOIN files f ON f.id = files_fts.rowid
+                    WHERE files_fts.path LIKE ? AND (? IS NULL OR f.file_type = ?)
+                """, (f"%{pattern}%", file_type, file_type))
+            else:
+                cursor = conn.execute(
+                    "SELECT path, file_type as type, size, modified_time as modified FROM files WHERE path LIKE ? AND (? IS NULL OR file_type = ?)",
+                    (f"%{pattern}%", file_type, file_type)
+                )
+            yield from cursor
     
     def get_database_stats(self):
         # get comprehensive database statistics
-        stats = {}
-        
-        # basic counts
-        cursor = self.conn.execute("SELECT COUNT(*) FROM files")
-        stats['total_files'] = cursor.fetchone()[0]
-        
-        cursor = self.conn.execute("SELECT COUNT(*) FROM relationships")
-        stats['total_relationships'] = cursor.fetchone()[0]
-        
-        cursor = self.conn.execute("SELECT COUNT(*) FROM system_snapshots")
-        stats['total_snapshots'] = cursor.fetchone()[0]
-        
-        # relationship type breakdown
-        cursor = self.conn.execute("""
-            SELECT relationship_type, COUNT(*) 
-            FROM relationships 
-            GROUP BY relationship_type 
-            ORDER BY COUNT(*) DESC
-        """)
-        stats['relationship_types'] = dict(cursor.fetchall())
-        
-        # file type breakdown
-        cursor = self.conn.execute("""
-            SELECT file_type, COUNT(*) 
-            FROM files 
-            GROUP BY file_type 
-            ORDER BY COUNT(*) DESC
-        """)
-        stats['file_types'] = dict(cursor.fetchall())
-        
-        return stats
+        with self._checkout() as conn:
+            stats = {}
+            
+            # basic counts
+            cursor = conn.execute("SELECT COUNT(*) FROM files")
+            stats['total_files'] = cursor.fetchone()[0]
+            
+            cursor = conn.execute("SELECT COUNT(*) FROM relationships")
+            stats['total_relationships'] = cursor.fetchone()[0]
+            
+            cursor = conn.execute("SELECT COUNT(*) FROM system_snapshots")
+            stats['total_snapshots'] = cursor.fetchone()[0]
+            
+            # relationship type breakdown
+            cursor = conn.execute("""
+                SELECT relationship_type, COUNT(*) 
+                FROM relationships 
+                GROUP BY relationship_type 
+                ORDER BY COUNT(*) DESC
+            """)
+            stats['relationship_types'] = dict(cursor.fetchall())
+            
+            # file type breakdown
+            cursor = conn.execute("""
+                SELECT file_type, COUNT(*) 
+                FROM files 
+                GROUP BY file_type 
+                ORDER BY COUNT(*) DESC
+            """)
+            stats['file_types'] = dict(cursor.fetchall())
+            
+            return stats
     
+    @_write_method
     def update_from_relationship_scan(self, scan_results):
-        # update database from file relationship scan results
+        # update database from file relationship scan results, collected first
+        # and written as executemany batches in a single transaction
+        targets = set()
+        sources = {}
+        edges = []
         for directory, dir_data in scan_results.get('directories', {}).items():
             connections = dir_data.get('connections', {})
             
             for source_file, file_data in connections.items():
-                # add source file
-                self.add_file_record(
-                    source_file,
-                    size=file_data.get('size'),
-                    modified_time=file_data.get('modified')
-                )
+                sources[source_file] = (source_file, None, file_data.get('size'), file_data.get('modified'), None)
                 
-                # add all relationships
                 for rel_type, target_files in file_data.get('references', {}).items():
                     for target_file in target_files:
-                        self.add_file_relationship(source_file, target_file, rel_type)
+                        targets.add(target_file)
+                        edges.append((source_file, target_file, rel_type))
+        
+        # scanned sources are upserted with their size and mtime, referenced
+        # files only need to exist and keep whatever they already had
+        with self.transaction():
+            self.add_file_records_bulk(sources.values())
+            self._ensure_files(targets.difference(sources))
+            self.add_relationships_bulk(edges)
     
     def get_change_timeline(self, file_path, days=7):
         # get change history for specific file
-        file_id = self._get_file_id(file_path)
-        if not file_id:
-            return []
-        
-        cutoff = datetime.now().timestamp() - (days * 24 * 3600)
-        cutoff_iso = datetime.fromtimestamp(cutoff).isoformat()
-        
-        cursor = self.conn.execute("""
-            SELECT change_type, old_value, new_value, timestamp
-            FROM file_changes
-            WHERE file_id = ? AND timestamp > ?
-            ORDER BY timestamp DESC
-        """, (file_id, cutoff_iso))
-        
-        return [
-            {'type': change_type, 'old': old_val, 'new': new_val, 'time': timestamp}
-            for change_type, old_val, new_val, timestamp in cursor
-        ]
-    
-    def _get_file_id(self, path):
-        # get file id by path
-        cursor = self.conn.execute("SELECT id FROM files WHERE path = ?", (path,))
+        return [dict(row) for row in self.iter_change_timeline(file_path, days)]
+    
+    def iter_change_timeline(self, file_path, days=7):
+        # stream rows with type, old, new and time, newest first, holding a pooled
+        # connection until the generator is exhausted or closed
+        with self._checkout() as conn:
+            file_id = self._get_file_id(file_path, conn)
+            if not file_id:
+                return
+            
+            cutoff = datetime.now().timestamp() - (days * 24 * 3600)
+            cutoff_iso = datetime.fromtimestamp(cutoff).isoformat()
+            
+            cursor = conn.execute("""
+                SELECT change_type as type, old_value as old, new_value as new, timestamp as time
+                FROM file_changes
+                WHERE file_id = ? AND timestamp > ?
+                ORDER BY timestamp DESC
+            """, (file_id, cutoff_iso))
+            yield from cursor
+    
+    def _cached_file_id(self, path):
+        with self._id_lock:
+            file_id = self._id_cache.get(path)
+            if file_id is not None:
+                self._id_cache.move_to_end(path)
+            return file_id
+    
+    def _cache_file_id(self, path, file_id):
+        with self._id_lock:
+            self._id_cache[path] = file_id
+            self._id_cache.move_to_end(path)
+            if len(self._id_cache) > FILE_ID_CACHE_SIZE:
+                self._id_cache.popitem(last=False)
+    
+    def _get_file_id(self, path, conn=None):
+        # get file id by path, from the lru cache when it's been seen recently;
+        # writes look up on self.conn so they see their own uncommitted rows
+        file_id = self._cached_file_id(path)
+        if file_id is not None:
+            return file_id
+        cursor = (conn or self.conn).execute("SELECT id FROM files WHERE path = ?", (path,))
         result = cursor.fetchone()
-        return result[0] if result else None
+        if result is None:
+            return None
+        self._cache_file_id(path, result[0])
+        return result[0]
+    
+    def _get_file_ids(self, paths):
+        # path -> id for many paths, one IN (...) query per chunk of parameters
+        ids = {}
+        missing = []
+        for path in paths:
+            file_id = self._cached_file_id(path)
+            if file_id is None:
+                missing.append(path)
+            else:
+                ids[path] = file_id
+        for i in range(0, len(missing), MAX_SQL_PARAMS):
+            chunk = missing[i:i + MAX_SQL_PARAMS]
+            cursor = self.conn.execute(
+                f"SELECT path, id FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for path, file_id in cursor:
+                ids[path] = file_id
+                self._cache_file_id(path, file_id)
+        return ids
     
     def close_connection(self):
-        # cleanup database connection
+        # cleanup database connection, pending writes are committed first
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        while not self._ro_pool.empty():
+            self._ro_pool.get().close()
         if self.conn:
+            self.conn.commit()
             self.conn.close()
 
-def create_knowledge_graph(db_path=None):
+def create_knowledge_graph(db_path=None, background_writer=False):
     # factory function for knowledge graph creation
     if db_path is None:
         db_path = "data/archive/spider_knowledge.db"
-    return KnowledgeGraphDB(db_path)
+    return KnowledgeGraphDB(db_path, background_writer)
+
+def _apply_spider_snapshot(graph, snapshot):
+    # store the snapshot
+    graph.store_system_snapshot(snapshot)
+    
+    # update file relationships if present
+    if 'file_relationships' in snapshot:
+        graph.update_from_relationship_scan(snapshot['file_relationships'])
+    
+    # track file changes if present
+    if 'file_changes' in snapshot:
+        # make sure every changed file exists, resolve their ids together and
+        # write all the change rows in one batch
+        changes = snapshot['file_changes'].get('recent_changes', [])
+        paths = {change['file'] for change in changes}
+        graph._ensure_files(paths)
+        ids = graph._get_file_ids(paths)
+        graph.conn.executemany("""
+            INSERT INTO file_changes (file_id, change_type, new_value, timestamp)
+            VALUES (?, ?, ?, ?)
+        """, [(ids[change['file']], ','.join(change['changes']), change['file'], change['time'])
+              for change in changes if change['file'] in ids])
 
 def update_graph_from_spider_data(graph, snapshot):
-    # update graph from spider snapshot data
-    try:
-        # store the snapshot
-        graph.store_system_snapshot(snapshot)
-        
-        # update file relationships if present
-        if 'file_relationships' in snapshot:
-            graph.update_from_relationship_scan(snapshot['file_relationships'])
-        
-        # track file changes if present
-        if 'file_changes' in snapshot:
-            changes = snapshot['file_changes']
-            for change in changes.get('recent_changes', []):
-                file_id = graph.add_file_record(change['file'])
-                if file_id:
-                    graph.conn.execute("""
-                        INSERT INTO file_changes (file_id, change_type, new_value, timestamp)
-                        VALUES (?, ?, ?, ?)
-                    """, (file_id, ','.join(change['changes']), change['file'], change['time']))
-            graph.conn.commit()
-            
-        return True
-        
-    except Exception as e:
-        return False
\ No newline at end of file
+    # update graph from spider snapshot data, the whole snapshot lands in one
+    # commit; with a background writer it's only queued here. a snapshot that
+    # stays locked out returns False, any other failure is logged and raised
+    for attempt in range(BUSY_RETRIES):
+        try:
+            graph.submit(_apply_spider_snapshot, graph, snapshot)
+            return True
+        except Exception as e:
+            # inside a caller's transaction nothing was rolled back, so a retry
+            # would apply part of the snapshot twice
+            if not _is_busy(e) or graph.conn.in_transaction:
+                logger.exception("knowledge graph update failed")
+                raise
+            logger.warning("knowledge graph locked, attempt %d of %d: %s", attempt + 1, BUSY_RETRIES, e)
+            time.sleep(BUSY_BACKOFF * 2 ** attempt)
+    return False
\ No newline at end of file